@@ -1,17 +1,117 @@
+import time
+STARTUP_STARTED = time.perf_counter()  # taken before the other imports, see startup_timings
+
 import os
 import sys
+import json
+import hashlib
+import importlib.util
+import itertools
+import math
+import random
+import collections
+import urllib.parse
+import re
+import shlex
+import signal
+import tempfile
 import subprocess
-import urllib.request
-import zipfile
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import threading
+import queue
 import shutil
+import logging
+import sqlite3
 
 # --- Music directory ---
 path_music_dir = os.path.join(os.getcwd(), "music")
 os.makedirs(path_music_dir, exist_ok=True)
 
+# --- Settings (settings.json next to the music directory) ---
+settings_path = os.path.join(os.getcwd(), "settings.json")
+
+DEFAULT_SETTINGS = {
+    # Parallel downloads; with the transcode stage on, these only wait on the network
+    "max_workers": 4,
+    # ffmpeg encodes run apart from the downloads, one per core by default (null);
+    # 0 converts inside yt-dlp instead. transcode_backlog: finished downloads allowed to
+    # wait for an encoder before download slots stall (null = twice the encoders)
+    "transcode_workers": None,
+    "transcode_backlog": None,
+    # MP3 downloads: "mp3" always encodes MP3; "copy-if-compatible" keeps AAC/MP3 audio as it
+    # is (.m4a/.mp3) and encodes the rest; "native" keeps any codec (.m4a, .opus, .ogg, .flac)
+    "audio_policy": "mp3",
+    # One JSON line per finished job (stage timings, bytes, retries, status); null turns it off
+    "metrics_file": "metrics.jsonl",
+    # Serve aggregate histograms at http://127.0.0.1:<port>/metrics for Prometheus; null = off
+    "metrics_port": None,
+    # metadata_cache.json: how long extracted info stays valid and how many videos it keeps
+    "metadata_cache_ttl_hours": 24,
+    "metadata_cache_max_entries": 2000,
+    # Info JSON handed from the title lookup to the download; also bounded by the URLs' own expiry
+    "info_json_max_age_minutes": 60,
+    # "inprocess" runs yt_dlp inside this process, "subprocess" spawns the yt-dlp CLI per job,
+    # "auto" picks in-process in Python mode and the CLI for the frozen build
+    "engine": "auto",
+    # Python mode: how often to look for a newer yt-dlp (runs in the background)
+    "update_check_hours": 24,
+    # Console: lines kept in memory/in the widget; optional rotating log file per job under logs/
+    "log_max_lines": 5000,
+    "job_log_files": False,
+    "job_log_max_bytes": 1024 * 1024,
+    "job_log_backups": 2,
+    # Download tuning: one of TUNING_PROFILES, or a profile of your own under "tuning_profiles"
+    "tuning_profile": "balanced",
+    "tuning_profiles": {},
+    # Total download budget shared by all running jobs ("4M" = 4 MiB/s, null = unlimited),
+    # time-of-day overrides like {"from": "09:00", "to": "18:00", "limit": "1M"},
+    # and each format's share of the budget relative to the others
+    "bandwidth_limit": None,
+    "bandwidth_schedule": [],
+    "bandwidth_weights": {"mp3": 1.0, "mp4": 1.0},
+    # Failed downloads: timeouts, resets, 5xx and throttling (HTTP 429) are retried up to
+    # retry_limit times after retry_base_seconds * 2^n (random jitter, capped at retry_max_seconds);
+    # a throttling host gets no new jobs for host_cooldown_seconds (doubling per trip) while others continue
+    "retry_limit": 4,
+    "retry_base_seconds": 5,
+    "retry_max_seconds": 300,
+    "host_cooldown_seconds": 60,
+    "host_cooldown_max_seconds": 900,
+    # A stored job that has been started this many times (over all sessions, crashes included)
+    # is marked failed on the next start instead of being queued again
+    "job_max_attempts": 10,
+    # Let the queue find its own number of parallel downloads (max_workers is the starting point):
+    # one more while that still adds throughput, halved on throttling, a full transcode backlog or a
+    # busy share of all cores above concurrency_cpu_limit (measured over the interval itself);
+    # re-evaluated every concurrency_interval_seconds
+    "adaptive_concurrency": True,
+    "concurrency_min": 1,
+    "concurrency_max": 12,
+    "concurrency_interval_seconds": 5,
+    "concurrency_cpu_limit": 0.9,
+}
+
+def load_settings():
+    """Load settings.json on top of the defaults"""
+    loaded = dict(DEFAULT_SETTINGS)
+    try:
+        with open(settings_path, "r", encoding="utf-8") as f:
+            loaded.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return loaded
+
+def save_settings():
+    """Write the current settings back to settings.json"""
+    try:
+        with open(settings_path, "w", encoding="utf-8") as f:
+            json.dump(settings, f, indent=2)
+    except OSError as e:
+        log_output(f"Could not save settings: {e}")
+
+settings = load_settings()
+
 # --- Check if running in a PyInstaller build ---
 def is_frozen():
     return getattr(sys, 'frozen', False)
@@ -31,21 +131,133 @@ if is_frozen():
         shutil.copy2(bundled_ytdlp, ytdlp_cmd)
 else:
     # Python mode
-    bin_path = os.path.join(os.environ['USERPROFILE'], "ffmpeg", "bin")
+    bin_path = os.path.join(os.environ.get('USERPROFILE', os.path.expanduser("~")), "ffmpeg", "bin")
     ytdlp_cmd = "yt-dlp"
 
+# --- yt-dlp binary versions (frozen build) ---
+# Updates land next to the old binary as yt-dlp-<timestamp>.exe and current.txt names the
+# active one, so new jobs switch over while running jobs finish on the binary they started with.
+def read_current_ytdlp():
+    """Active yt-dlp.exe according to current.txt, else the plain copy"""
+    try:
+        with open(os.path.join(ytdlp_dir, "current.txt"), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+        if name and os.path.exists(os.path.join(ytdlp_dir, name)):
+            return os.path.join(ytdlp_dir, name)
+    except OSError:
+        pass
+    return os.path.join(ytdlp_dir, "yt-dlp.exe")
+
+def switch_ytdlp(path):
+    """Atomically point new jobs at another yt-dlp binary"""
+    global ytdlp_cmd
+    pointer = os.path.join(ytdlp_dir, "current.txt")
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path))
+    os.replace(pointer + ".tmp", pointer)
+    ytdlp_cmd = path
+
+def prune_old_ytdlp():
+    """Delete superseded versions; ones still running are locked and skipped until next time"""
+    for name in os.listdir(ytdlp_dir):
+        path = os.path.join(ytdlp_dir, name)
+        if name.startswith("yt-dlp-") and name.endswith(".exe") and path != ytdlp_cmd:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+if is_frozen():
+    ytdlp_cmd = read_current_ytdlp()
+    prune_old_ytdlp()
+
 # Global flag to track if dependencies are ready
 dependencies_ready = False
 setup_error = None
 
-def log_output(message):
-    """Log messages to console window if it exists"""
-    try:
-        console_text.insert(tk.END, message + "\n")
-        console_text.see(tk.END)
-        root.update_idletasks()
-    except:
-        print(message)
+# When the last yt-dlp update check ran (Python mode)
+dependency_state_path = os.path.join(os.getcwd(), "dependency_state.json")
+
+# Seconds since startup: "import" (module loaded) and "ready" (downloads allowed)
+startup_timings = {}
+
+# Tk widgets, created by build_gui(); they stay None in batch mode
+root = None
+console_text = None
+
+def ui_after(callback):
+    """Run callback on the Tk thread (dropped in batch mode)"""
+    if root is not None:
+        root.after(0, callback)
+
+class Throttle:
+    """Lets an action through at most once per interval (seconds)"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = 0.0
+
+    def ready(self):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
+
+# --- Console log sink ---
+# Worker threads only append to these ring buffers (deque appends are thread-safe);
+# drain_log() moves new lines into the widget in batches from the Tk thread.
+LOG_DRAIN_MS = 150
+log_lines = collections.deque(maxlen=settings["log_max_lines"])    # history shown after reopening
+log_pending = collections.deque(maxlen=settings["log_max_lines"])  # not yet in the widget
+log_dir = os.path.join(os.getcwd(), "logs")
+
+def log_output(message, job=None):
+    """Log messages to console window if it exists (stderr in batch mode)"""
+    if job is not None:
+        job.output_tail.append(message)
+    if job is not None and job.log_file is not None:
+        job.log_file.handle(logging.makeLogRecord({"msg": message}))
+    if console_text is None:
+        print(message, file=sys.stderr)
+        return
+    log_lines.append(message)
+    log_pending.append(message)
+
+def drain_log():
+    """Insert pending log lines into the console in one go and trim it to log_max_lines"""
+    if console_frame.winfo_viewable():
+        batch = []
+        while log_pending:
+            batch.append(log_pending.popleft())
+        if batch:
+            console_text.insert(tk.END, "\n".join(batch) + "\n")
+            excess = int(console_text.index("end-1c").split(".")[0]) - 1 - settings["log_max_lines"]
+            if excess > 0:
+                console_text.delete("1.0", f"{excess + 1}.0")
+            console_text.see(tk.END)
+    else:
+        # Hidden console: nothing to draw, reopening rebuilds it from log_lines
+        log_pending.clear()
+    root.after(LOG_DRAIN_MS, drain_log)
+
+def rebuild_console():
+    console_text.delete("1.0", tk.END)
+    log_pending.clear()
+    if log_lines:
+        console_text.insert(tk.END, "\n".join(list(log_lines)) + "\n")
+    console_text.see(tk.END)
+
+def open_job_log(job):
+    """Rotating log file for one job's output (job_log_files setting)"""
+    import logging.handlers
+    os.makedirs(log_dir, exist_ok=True)
+    path = os.path.join(log_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-job{job.id}.log")
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=settings["job_log_max_bytes"], backupCount=settings["job_log_backups"],
+        encoding="utf-8", delay=True)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    return handler
 
 def update_ytdlp():
     """Update yt-dlp to latest version"""
@@ -56,28 +268,39 @@ def update_ytdlp():
             log_output("="*50)
             
             if is_frozen():
-                # Download latest yt-dlp.exe
+                # Download latest yt-dlp.exe next to the running one
                 url = "https://github.com/yt-dlp/yt-dlp/releases/latest/download/yt-dlp.exe"
-                temp_file = ytdlp_cmd + ".tmp"
+                staged_file = os.path.join(ytdlp_dir, "yt-dlp-next.exe")
+                new_file = os.path.join(ytdlp_dir, f"yt-dlp-{time.strftime('%Y%m%d-%H%M%S')}.exe")
                 
                 log_output(f"Downloading from: {url}")
                 
-                def download_progress(block_num, block_size, total_size):
-                    downloaded = block_num * block_size
-                    percent = min(100, int(downloaded * 100 / total_size))
-                    root.after(0, lambda p=percent: status_label.config(
-                        text=f"Downloading yt-dlp: {p}%", fg="orange"))
+                # At most 10 status updates per second instead of one per block
+                throttle = Throttle(0.1)
+                def download_progress(downloaded, total_size):
+                    if total_size and throttle.ready():
+                        percent = min(100, int(downloaded * 100 / total_size))
+                        ui_after(lambda p=percent: status_label.config(
+                            text=f"Downloading yt-dlp: {p}%", fg="orange"))
                 
-                urllib.request.urlretrieve(url, temp_file, download_progress)
+                download_resumable(url, staged_file, download_progress)
+                os.replace(staged_file, new_file)
+                
+                # Only switch to a binary that actually runs
+                check = subprocess.run(
+                    [new_file, "--version"], capture_output=True, text=True, timeout=120,
+                    creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+                )
+                if check.returncode != 0:
+                    os.remove(new_file)
+                    raise RuntimeError(f"Downloaded yt-dlp does not run: {check.stderr.strip()}")
                 
-                # Replace old version
-                if os.path.exists(ytdlp_cmd):
-                    os.remove(ytdlp_cmd)
-                os.rename(temp_file, ytdlp_cmd)
+                switch_ytdlp(new_file)
+                prune_old_ytdlp()
                 
-                log_output("✓ yt-dlp updated successfully!")
-                root.after(0, lambda: status_label.config(text="yt-dlp updated! Ready", fg="green"))
-                root.after(0, lambda: messagebox.showinfo("Success", "yt-dlp updated to latest version!"))
+                log_output(f"✓ yt-dlp updated successfully! ({check.stdout.strip()})")
+                ui_after(lambda: status_label.config(text="yt-dlp updated! Ready", fg="green"))
+                ui_after(lambda: messagebox.showinfo("Success", "yt-dlp updated to latest version!"))
             else:
                 # Python mode: use pip
                 log_output("Running: pip install --upgrade yt-dlp")
@@ -89,121 +312,744 @@ def update_ytdlp():
                 
                 if result.returncode == 0:
                     log_output("✓ yt-dlp updated successfully!")
-                    root.after(0, lambda: status_label.config(text="yt-dlp updated! Ready", fg="green"))
-                    root.after(0, lambda: messagebox.showinfo("Success", "yt-dlp updated to latest version!"))
+                    ui_after(lambda: status_label.config(text="yt-dlp updated! Ready", fg="green"))
+                    ui_after(lambda: messagebox.showinfo("Success", "yt-dlp updated to latest version!"))
                 else:
                     log_output(f"ERROR: {result.stderr}")
-                    root.after(0, lambda: messagebox.showerror("Update Failed", result.stderr))
+                    ui_after(lambda: messagebox.showerror("Update Failed", result.stderr))
                     
         except Exception as e:
             log_output(f"ERROR updating yt-dlp: {e}")
-            root.after(0, lambda: status_label.config(text="Update failed", fg="red"))
-            root.after(0, lambda: messagebox.showerror("Update Failed", str(e)))
+            ui_after(lambda: status_label.config(text="Update failed", fg="red"))
+            message = str(e)
+            ui_after(lambda: messagebox.showerror("Update Failed", message))
     
     threading.Thread(target=do_update, daemon=True).start()
 
 def setup_dependencies():
     """Run dependency checks in background thread"""
     global dependencies_ready, setup_error
+    sweep_info_cache()
     
     if is_frozen():
         # Check if bundled files exist
         if not os.path.exists(ytdlp_cmd):
             setup_error = f"yt-dlp not found at: {ytdlp_cmd}"
             log_output(f"ERROR: {setup_error}")
-            root.after(0, lambda: status_label.config(text="yt-dlp missing! Click Update", fg="red"))
+            ui_after(lambda: status_label.config(text="yt-dlp missing! Click Update", fg="red"))
             return
         
         if not os.path.exists(bin_path):
             setup_error = f"ffmpeg not found at: {bin_path}"
             log_output(f"ERROR: {setup_error}")
-            root.after(0, lambda: status_label.config(text="ffmpeg missing!", fg="red"))
+            ui_after(lambda: status_label.config(text="ffmpeg missing!", fg="red"))
             return
         
         log_output(f"✓ Found yt-dlp: {ytdlp_cmd}")
         log_output(f"✓ Found ffmpeg: {bin_path}")
         dependencies_ready = True
-        root.after(0, lambda: status_label.config(text="Ready", fg="green"))
+        mark_ready()
         return
     
     try:
-        # --- Install/Update yt-dlp in Python mode ---
-        try:
-            import yt_dlp
-            log_output("✓ yt-dlp module found")
-            
-            # Auto-update on startup in Python mode
-            log_output("Checking for yt-dlp updates...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade", "yt-dlp"],
-                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            log_output("✓ yt-dlp is up to date")
-        except ImportError:
-            log_output("Installing yt-dlp...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "yt-dlp"])
-            import yt_dlp
-            log_output("✓ yt-dlp installed")
-
-        # --- Download ffmpeg if missing ---
-        ffmpeg_exe = os.path.join(bin_path, "ffmpeg.exe")
-        ffprobe_exe = os.path.join(bin_path, "ffprobe.exe")
-
-        if not (os.path.isfile(ffmpeg_exe) and os.path.isfile(ffprobe_exe)):
-            log_output("Downloading ffmpeg...")
-            os.makedirs(bin_path, exist_ok=True)
-            zip_url = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
-            zip_file = os.path.join(bin_path, "ffmpeg.zip")
-            urllib.request.urlretrieve(zip_url, zip_file)
-            
-            log_output("Extracting ffmpeg...")
-            with zipfile.ZipFile(zip_file, "r") as zip_ref:
-                # Extract and move files from nested folder
-                for member in zip_ref.namelist():
-                    if member.endswith(('.exe', '.dll')) and '/bin/' in member:
-                        filename = os.path.basename(member)
-                        source = zip_ref.open(member)
-                        target = open(os.path.join(bin_path, filename), "wb")
-                        target.write(source.read())
-                        target.close()
-                        source.close()
-            
-            os.remove(zip_file)
-            log_output("✓ ffmpeg setup complete")
-        else:
-            log_output("✓ ffmpeg found")
+        # yt-dlp check/update and the ffmpeg probe run side by side
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            checks = [pool.submit(ensure_ytdlp), pool.submit(ensure_ffmpeg)]
+            for check in checks:
+                check.result()
         
         dependencies_ready = True
-        root.after(0, lambda: status_label.config(text="Ready", fg="green"))
+        mark_ready()
     except Exception as e:
         setup_error = str(e)
         log_output(f"ERROR: {e}")
-        root.after(0, lambda: status_label.config(text="Setup failed!", fg="red"))
+        ui_after(lambda: status_label.config(text="Setup failed!", fg="red"))
 
-# --- Function to update the title in the Save-as field for YouTube URLs ---
-def update_title(*args):
-    url = entry_url.get().strip()
-    if not url or not ("youtube.com" in url or "youtu.be" in url):
+def mark_ready():
+    """Record and show the time from launch until downloads are allowed"""
+    startup_timings["ready"] = time.perf_counter() - STARTUP_STARTED
+    log_output(f"✓ Ready in {startup_timings['ready']:.2f} s "
+               f"(module import {startup_timings.get('import', 0):.2f} s)")
+    ui_after(lambda: status_label.config(text="Ready", fg="green"))
+
+def load_dependency_state():
+    """Last yt-dlp update check (dependency_state.json)"""
+    try:
+        with open(dependency_state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_dependency_state(state):
+    try:
+        with open(dependency_state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+    except OSError as e:
+        log_output(f"Could not save dependency state: {e}")
+
+def installed_ytdlp_version():
+    """Version of the installed yt-dlp package, read from its metadata without importing it"""
+    import importlib.metadata
+    try:
+        return importlib.metadata.version("yt-dlp")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+# Cleared while pip replaces yt-dlp's files: an import then (extractors are loaded lazily, so even
+# after the first one) or a yt-dlp process could mix old and new modules, so they wait for it
+ytdlp_unlocked = threading.Event()
+ytdlp_unlocked.set()
+
+def wait_for_ytdlp_upgrade(job=None):
+    """Block until a running pip upgrade of yt-dlp has finished"""
+    if not ytdlp_unlocked.is_set():
+        log_output("Waiting for the yt-dlp update to finish...", job)
+        ytdlp_unlocked.wait()
+
+def upgrade_ytdlp_in_background():
+    """pip upgrade of yt-dlp in a thread; yt-dlp work started meanwhile waits for it"""
+    def do_upgrade():
+        try:
+            before = installed_ytdlp_version()
+            result = subprocess.run([sys.executable, "-m", "pip", "install", "--upgrade", "yt-dlp"],
+                                    capture_output=True, text=True)
+        finally:
+            ytdlp_unlocked.set()
+        if result.returncode != 0:
+            log_output(f"yt-dlp update check failed: {result.stderr.strip()}")
+            return
+        after = installed_ytdlp_version()
+        save_dependency_state({"ytdlp_checked": time.time(), "ytdlp_version": after})
+        if after != before:
+            log_output(f"✓ yt-dlp updated {before} -> {after}")
+        else:
+            log_output(f"✓ yt-dlp is up to date ({after})")
+
+    ytdlp_unlocked.clear()
+    # Not a daemon: closing the app must not kill pip halfway through replacing files
+    threading.Thread(target=do_upgrade).start()
+
+def ensure_ytdlp():
+    """Install yt-dlp if missing; schedule an update check when one is due"""
+    if importlib.util.find_spec("yt_dlp") is None:
+        log_output("Installing yt-dlp...")
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "yt-dlp"])
+        save_dependency_state({"ytdlp_checked": time.time(), "ytdlp_version": installed_ytdlp_version()})
+        log_output("✓ yt-dlp installed")
         return
     
+    log_output(f"✓ yt-dlp module found ({installed_ytdlp_version()})")
+    last_check = load_dependency_state().get("ytdlp_checked", 0)
+    if time.time() - last_check >= settings["update_check_hours"] * 3600:
+        log_output("Checking for yt-dlp updates in the background...")
+        upgrade_ytdlp_in_background()
+
+def ensure_ffmpeg():
+    """Locate ffmpeg, downloading the Windows build if it's missing"""
+    global bin_path
+    ffmpeg_exe = os.path.join(bin_path, "ffmpeg.exe")
+    ffprobe_exe = os.path.join(bin_path, "ffprobe.exe")
+
+    if sys.platform != "win32":
+        # Servers/cron: there is no prebuilt zip, use the ffmpeg on PATH
+        system_ffmpeg = shutil.which("ffmpeg")
+        if not system_ffmpeg:
+            raise RuntimeError("ffmpeg not found on PATH")
+        bin_path = os.path.dirname(system_ffmpeg)
+        log_output(f"✓ ffmpeg found: {system_ffmpeg}")
+    elif verify_ffmpeg_manifest(bin_path):
+        log_output("✓ ffmpeg found")
+    elif (os.path.isfile(ffmpeg_exe) and os.path.isfile(ffprobe_exe)
+          and not os.path.exists(ffmpeg_manifest_path(bin_path))):
+        # Unpacked before manifests existed: hash it once, later starts only stat it
+        write_ffmpeg_manifest(bin_path, manifest_from_files(bin_path))
+        log_output("✓ ffmpeg found")
+    else:
+        log_output("Downloading ffmpeg...")
+        bootstrap_ffmpeg(FFMPEG_ZIP_URL, bin_path)
+        log_output("✓ ffmpeg setup complete")
+
+# --- ffmpeg bootstrap (Windows, Python mode) ---
+FFMPEG_ZIP_URL = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
+FFMPEG_BINARIES = ("ffmpeg.exe", "ffprobe.exe")
+COPY_CHUNK = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def discard_part(part_path):
+    """Delete a partial download and the validator saved next to it"""
+    for stale in (part_path, part_path + ".json"):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+def download_resumable(url, path, progress=None):
+    """Stream url to path through path + ".part", continuing a previous partial download of the same file"""
+    # progress(downloaded, total) is called per chunk; total is None if the size is unknown
+    import urllib.request
+    import urllib.error
+    part_path = path + ".part"
+    meta_path = part_path + ".json"  # ETag / Last-Modified / size of the file the part belongs to
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    if offset and not meta.get("size"):
+        discard_part(part_path)  # nothing tells which file the bytes came from
+        offset = 0
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        # The server only honours the range if the file is unchanged, otherwise it sends all of it
+        validator = meta.get("etag") or meta.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # The part does not fit the file on the server any more, start over
+        discard_part(part_path)
+        return download_resumable(url, path, progress)
+    with response:
+        total = None
+        if offset and response.status == 206:
+            match = re.match(r"bytes (\d+)-\d+/(\d+)", response.headers.get("Content-Range", ""))
+            if not match or int(match.group(1)) != offset or int(match.group(2)) != meta["size"]:
+                # Same URL, different file: splicing it onto the part would corrupt both
+                discard_part(part_path)
+                return download_resumable(url, path, progress)
+            total = meta["size"]
+        else:
+            offset = 0  # a fresh download, or the server ignored the range / If-Range
+            length = response.headers.get("Content-Length")
+            total = int(length) if length is not None else None
+            etag = response.headers.get("ETag")
+            meta = {
+                "etag": etag if etag and not etag.startswith("W/") else None,  # If-Range needs a strong ETag
+                "last_modified": response.headers.get("Last-Modified"),
+                "size": total,
+            }
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        with open(part_path, "ab" if offset else "wb") as f:
+            while True:
+                chunk = response.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                f.write(chunk)
+                offset += len(chunk)
+                if progress:
+                    progress(offset, total)
+    if total is not None and offset < total:
+        raise IOError(f"Download interrupted at {offset} of {total} bytes, it resumes on the next start")
+    os.replace(part_path, path)
+    discard_part(part_path)
+
+def extract_ffmpeg_binaries(zip_path, target_dir):
+    """Stream the needed bin/ members into target_dir; returns their manifest entries"""
+    import zipfile
+    manifest = {}
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for member in zip_ref.infolist():
+            name = os.path.basename(member.filename)
+            if "/bin/" not in member.filename or not (name in FFMPEG_BINARIES or name.endswith(".dll")):
+                continue
+            target = os.path.join(target_dir, name)
+            digest = hashlib.sha256()
+            with zip_ref.open(member) as source, open(target + ".tmp", "wb") as f:
+                while True:
+                    chunk = source.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.replace(target + ".tmp", target)
+            stat = os.stat(target)
+            manifest[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+    missing = [name for name in FFMPEG_BINARIES if name not in manifest]
+    if missing:
+        raise RuntimeError(f"ffmpeg archive has no {', '.join(missing)}")
+    return manifest
+
+def ffmpeg_manifest_path(target_dir):
+    return os.path.join(target_dir, "ffmpeg_manifest.json")
+
+def write_ffmpeg_manifest(target_dir, manifest):
+    with open(ffmpeg_manifest_path(target_dir), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def manifest_from_files(target_dir):
+    """Manifest for binaries that are already unpacked (installs from before the manifest)"""
+    manifest = {}
+    for name in os.listdir(target_dir):
+        if name in FFMPEG_BINARIES or name.endswith(".dll"):
+            path = os.path.join(target_dir, name)
+            stat = os.stat(path)
+            manifest[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_sha256(path)}
+    return manifest
+
+def verify_ffmpeg_manifest(target_dir):
+    """Check the unpacked binaries against the manifest; only changed files get re-hashed"""
+    try:
+        with open(ffmpeg_manifest_path(target_dir), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if any(name not in manifest for name in FFMPEG_BINARIES):
+        return False
+    changed = False
+    for name, entry in manifest.items():
+        path = os.path.join(target_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime != entry["mtime"]:
+            if file_sha256(path) != entry["sha256"]:
+                return False
+            entry["mtime"] = stat.st_mtime
+            changed = True
+    if changed:
+        write_ffmpeg_manifest(target_dir, manifest)
+    return True
+
+def bootstrap_ffmpeg(zip_url, target_dir):
+    """Download (resumable) and unpack ffmpeg into target_dir, recording a checksum manifest"""
+    import zipfile
+    os.makedirs(target_dir, exist_ok=True)
+    zip_file = os.path.join(target_dir, "ffmpeg.zip")
+    if not os.path.exists(zip_file):
+        download_resumable(zip_url, zip_file)
+    
+    log_output("Extracting ffmpeg...")
+    try:
+        manifest = extract_ffmpeg_binaries(zip_file, target_dir)
+    except zipfile.BadZipFile:
+        os.remove(zip_file)  # fetch it again next time instead of failing forever
+        raise
+    write_ffmpeg_manifest(target_dir, manifest)
+    os.remove(zip_file)
+    return manifest
+
+# --- Metadata lookup (title field and batch mode) ---
+def fetch_info(url):
+    """Extract the info dict for a single video without downloading it"""
+    wait_for_ytdlp_upgrade()
+    import yt_dlp
+    ydl_opts = {
+        "quiet": True, 
+        "no_warnings": True,
+        "noplaylist": True,
+        "extractor_args": {"youtube": {"player_client": ["android", "web"]}}
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+# --- Metadata cache (metadata_cache.json) ---
+def video_cache_key(url):
+    """Normalized video ID for a URL ("youtube:<id>"), or the cleaned URL for other sites"""
+    url = url.strip()
+    parsed = urllib.parse.urlparse(url)
+    host = parsed.netloc.lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parsed.path.strip("/").split("/")
+    video_id = None
+    if host == "youtu.be" and path[0]:
+        video_id = path[0]
+    elif host == "youtube.com":
+        if path[0] == "watch":
+            video_id = urllib.parse.parse_qs(parsed.query).get("v", [None])[0]
+        elif path[0] in ("shorts", "embed", "live", "v") and len(path) > 1:
+            video_id = path[1]
+    if video_id:
+        return f"youtube:{video_id}"
+    return url.split("#")[0].split("&list=")[0]
+
+def compact_info(info):
+    """The part of a yt-dlp info dict worth keeping on disk"""
+    return {
+        "id": info.get("id"),
+        "extractor_key": info.get("extractor_key"),
+        "title": info.get("title", ""),
+        "duration": info.get("duration"),
+        "webpage_url": info.get("webpage_url"),
+        "formats": [
+            {key: f.get(key) for key in ("format_id", "ext", "acodec", "vcodec", "abr", "tbr", "height", "filesize")}
+            for f in info.get("formats") or []
+        ],
+    }
+
+class MetadataCache:
+    """Extracted video info on disk, expired after a TTL and evicted least-recently-used first"""
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def _save(self):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            log_output(f"Could not save metadata cache: {e}")
+
+    def _drop(self, key):
+        discard_info_json(self._entries.pop(key)["info"].get("info_json"))
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry["fetched"] > self.ttl:
+                self._drop(key)
+                return None
+            entry["used"] = now  # written with the next put()
+            return entry["info"]
+
+    def put(self, key, info):
+        with self._lock:
+            self._load()
+            now = time.time()
+            self._entries[key] = {"fetched": now, "used": now, "info": info}
+            if len(self._entries) > self.max_entries:
+                by_use = sorted(self._entries, key=lambda k: self._entries[k]["used"])
+                for old_key in by_use[:len(self._entries) - self.max_entries]:
+                    self._drop(old_key)
+            self._save()
+
+metadata_cache = MetadataCache(
+    os.path.join(os.getcwd(), "metadata_cache.json"),
+    settings["metadata_cache_ttl_hours"] * 3600,
+    settings["metadata_cache_max_entries"],
+)
+
+# Full info dicts saved for the download stage (yt-dlp --load-info-json)
+info_json_dir = os.path.join(os.getcwd(), "info_cache")
+
+# Don't start a download on format URLs that expire sooner than this
+INFO_JSON_MARGIN = 10 * 60
+
+def format_urls_expiry(info):
+    """Earliest expiry of the signed format URLs (YouTube 'expire' parameter), or None"""
+    expiries = []
+    for f in info.get("formats") or []:
+        parsed = urllib.parse.urlparse(f.get("url") or "")
+        expire = urllib.parse.parse_qs(parsed.query).get("expire", [None])[0]
+        if expire is None and "/expire/" in parsed.path:
+            expire = parsed.path.split("/expire/")[1].split("/")[0]
+        try:
+            expiries.append(int(expire))
+        except (TypeError, ValueError):
+            pass
+    return min(expiries) if expiries else None
+
+def save_info_json(key, info):
+    """Write the full info dict for the downloader; returns its path and expiry"""
+    import yt_dlp
+    os.makedirs(info_json_dir, exist_ok=True)
+    path = os.path.join(info_json_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".info.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(yt_dlp.YoutubeDL.sanitize_info(info), f)
+    expires = time.time() + settings["info_json_max_age_minutes"] * 60
+    url_expiry = format_urls_expiry(info)
+    if url_expiry is not None:
+        expires = min(expires, url_expiry)
+    return path, expires
+
+def get_video_info(url):
+    """Cached info for a video; extracts (and caches) it on a miss"""
+    key = video_cache_key(url)
+    info = metadata_cache.get(key)
+    if info is None:
+        full_info = fetch_info(url)
+        info = compact_info(full_info)
+        try:
+            info["info_json"], info["info_json_expires"] = save_info_json(key, full_info)
+        except (OSError, TypeError, ValueError) as e:
+            log_output(f"Could not save info JSON: {e}")
+        metadata_cache.put(key, info)
+    return info
+
+def fresh_info_json(url):
+    """Info JSON from an earlier lookup, if its format URLs are still usable"""
+    info = metadata_cache.get(video_cache_key(url))
+    if not info or not info.get("info_json") or not os.path.exists(info["info_json"]):
+        return None
+    if info.get("info_json_expires", 0) < time.time() + INFO_JSON_MARGIN:
+        discard_info_json(info["info_json"])  # never usable again, and a few MB each
+        return None
+    return info["info_json"]
+
+def discard_info_json(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def sweep_info_cache():
+    """Delete info JSONs older than info_json_max_age_minutes (they can't be used any more)"""
+    cutoff = time.time() - settings["info_json_max_age_minutes"] * 60
+    try:
+        with os.scandir(info_json_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".info.json") and entry.stat().st_mtime < cutoff:
+                    discard_info_json(entry.path)
+    except OSError:
+        pass
+
+# --- Library index (library_index.sqlite3) ---
+# Maps (extractor, video id, format) to a finished file so a video is never fetched twice
+LIBRARY_EXTENSIONS = (".mp3", ".mp4", ".m4a", ".opus", ".ogg", ".flac", ".webm", ".mkv")  # every AUDIO_CONTAINERS extension too
+# Every recorded file also gets a line here, in its own folder, so --rebuild-index can tell
+# which video a file came from whatever it is named
+LIBRARY_SOURCES_NAME = ".library_sources.jsonl"
+
+def library_key(url):
+    """(extractor, video id) for a URL, worked out without any network access"""
+    key = video_cache_key(url)
+    if key.startswith("youtube:"):
+        return "youtube", key[len("youtube:"):]
+    return "url", key
+
+def youtube_id_from_filename(name):
+    """Video ID from yt-dlp's default "Title [id].ext" naming, if present"""
+    stem = os.path.splitext(name)[0]
+    if stem.endswith("]") and "[" in stem:
+        candidate = stem[stem.rindex("[") + 1:-1]
+        if len(candidate) == 11 and all(c.isalnum() or c in "-_" for c in candidate):
+            return candidate
+    return None
+
+class LibraryIndex:
+    """Persistent index of downloaded files keyed by extractor, video ID and format"""
+
+    def __init__(self, path):
+        self.path = path
+        self.sources_lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS library (
+                extractor TEXT, video_id TEXT, format TEXT,
+                path TEXT, size INTEGER, mtime REAL, sha256 TEXT, added REAL,
+                PRIMARY KEY (extractor, video_id, format))""")
+
+    def _connect(self):
+        # One short-lived connection per call keeps it usable from every worker thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lookup(self, key, format_type):
+        """Path of the indexed file if it is still there with the recorded size"""
+        with self._connect() as db:
+            row = db.execute("SELECT path, size FROM library WHERE extractor=? AND video_id=? AND format=?",
+                             (key[0], key[1], format_type)).fetchone()
+            if row is None:
+                return None
+            try:
+                if os.path.getsize(row[0]) == row[1]:
+                    return row[0]
+            except OSError:
+                pass
+            db.execute("DELETE FROM library WHERE extractor=? AND video_id=? AND format=?",
+                       (key[0], key[1], format_type))
+        return None
+
+    def record(self, key, format_type, path, sha256=None):
+        stat = os.stat(path)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (key[0], key[1], format_type, path, stat.st_size, stat.st_mtime,
+                        sha256 or file_sha256(path), time.time()))
+        line = {"file": os.path.basename(path), "extractor": key[0], "id": key[1], "format": format_type}
+        try:
+            with self.sources_lock, open(os.path.join(os.path.dirname(path), LIBRARY_SOURCES_NAME),
+                                         "a", encoding="utf-8") as f:
+                f.write(json.dumps(line) + "\n")
+        except OSError as e:
+            log_output(f"Could not note the source of {path}: {e}")
+
+    @staticmethod
+    def read_sources(sources_path):
+        """file name -> (extractor, video id, format) from a folder's sources file, later lines winning"""
+        sources = {}
+        try:
+            with open(sources_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        sources[entry["file"]] = (entry["extractor"], entry["id"], entry["format"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # a line cut short by a crash
+        except OSError:
+            pass
+        return sources
+
+    def rebuild(self, music_dir, workers=8):
+        """Re-index music_dir: keep unchanged rows, re-hash changed files, add files whose source
+        is noted in their folder's sources file or that are named Title [id].ext"""
+        from concurrent.futures import ThreadPoolExecutor
+        with self._connect() as db:
+            rows = {row[3]: row for row in db.execute("SELECT * FROM library")}
+
+        files = {}
+        sources = {}  # folder -> its sources file entries
+        pending = [music_dir]
+        while pending:
+            folder = pending.pop()
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != SCRATCH_DIR_NAME:
+                            pending.append(entry.path)
+                    elif entry.name == LIBRARY_SOURCES_NAME:
+                        sources[folder] = self.read_sources(entry.path)
+                    elif entry.name.lower().endswith(LIBRARY_EXTENSIONS):
+                        files[entry.path] = entry.stat()
+
+        keep, to_hash, unknown = [], [], 0
+        for path, stat in files.items():
+            row = rows.get(path)
+            if row is not None:
+                if row[4] == stat.st_size and row[5] == stat.st_mtime:
+                    keep.append(row)
+                else:
+                    to_hash.append((row[0], row[1], row[2], path, stat))
+                continue
+            source = sources.get(os.path.dirname(path), {}).get(os.path.basename(path))
+            video_id = youtube_id_from_filename(os.path.basename(path))
+            if source:
+                to_hash.append(source + (path, stat))
+            elif video_id:
+                to_hash.append(("youtube", video_id, os.path.splitext(path)[1][1:].lower(), path, stat))
+            else:
+                unknown += 1
+
+        # Hashing is I/O bound and hashlib releases the GIL, so threads scale here
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = list(pool.map(lambda item: file_sha256(item[3]), to_hash))
+        now = time.time()
+        with self._connect() as db:
+            db.execute("DELETE FROM library")
+            db.executemany("INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?, ?, ?, ?, ?)", keep + [
+                (extractor, video_id, format_type, path, stat.st_size, stat.st_mtime, sha256, now)
+                for (extractor, video_id, format_type, path, stat), sha256 in zip(to_hash, hashes)])
+        # Compact the sources files down to the files that are still there
+        with self.sources_lock:
+            for folder, entries in sources.items():
+                kept = [{"file": name, "extractor": source[0], "id": source[1], "format": source[2]}
+                        for name, source in entries.items() if os.path.join(folder, name) in files]
+                try:
+                    with open(os.path.join(folder, LIBRARY_SOURCES_NAME), "w", encoding="utf-8") as f:
+                        f.writelines(json.dumps(line) + "\n" for line in kept)
+                except OSError:
+                    pass
+        return {"files": len(files), "unchanged": len(keep), "hashed": len(to_hash),
+                "removed": len(set(rows) - set(files)), "unidentified": unknown}
+
+library_index = LibraryIndex(os.path.join(os.getcwd(), "library_index.sqlite3"))
+
+def link_or_copy(source, target):
+    """Hard-link an existing library file to a new name, copying where links aren't possible"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+# --- Function to update the title in the Save-as field for YouTube URLs ---
+TITLE_DEBOUNCE_MS = 400
+
+title_after_id = None   # pending debounced lookup
+title_request = 0       # bumped per lookup; results of older lookups are dropped
+auto_title = ""         # last title we filled in, anything else was typed by the user
+
+def title_lookup_url(url):
+    """URL to resolve a title for, or None if it isn't a YouTube link"""
+    url = url.strip()
+    if not url or not ("youtube.com" in url or "youtu.be" in url):
+        return None
     url = url.split("&list=")[0]
     url = url.split("?")[0] if "?" in url and "v=" not in url else url
-    
+    return url
+
+def update_title(*args):
+    """Debounce focus changes before starting a background title lookup"""
+    global title_after_id
+    if title_after_id is not None:
+        root.after_cancel(title_after_id)
+    title_after_id = root.after(TITLE_DEBOUNCE_MS, start_title_lookup)
+
+def start_title_lookup():
+    global title_after_id, title_request
+    title_after_id = None
+    url = title_lookup_url(entry_url.get())
+    if not url:
+        return
+    title_request += 1
+    resolve_label.config(text="resolving…")
+    log_output(f"Fetching title for: {url}")
+    threading.Thread(target=resolve_title, args=(title_request, url), daemon=True).start()
+
+def resolve_title(request, url):
+    """Worker thread: extract the title and hand it back to the Tk thread"""
     try:
-        import yt_dlp
-        log_output(f"Fetching title for: {url}")
-        ydl_opts = {
-            "quiet": True, 
-            "no_warnings": True,
-            "extractor_args": {"youtube": {"player_client": ["android", "web"]}}
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title = info.get("title", "")
-            if title:
-                entry_name.delete(0, tk.END)
-                entry_name.insert(0, title)
-                log_output(f"✓ Title: {title}")
+        title, error = get_video_info(url).get("title", ""), None
     except Exception as e:
-        log_output(f"Could not fetch title: {e}")
+        title, error = "", e
+    ui_after(lambda: apply_title(request, url, title, error))
+
+def apply_title(request, url, title, error):
+    global auto_title
+    if request != title_request:
+        return  # a newer lookup owns the indicator
+    resolve_label.config(text="")
+    if title_lookup_url(entry_url.get()) != url:
+        return  # URL was edited while resolving
+    if error:
+        log_output(f"Could not fetch title: {error}")
+        return
+    if not title:
+        return
+    current = entry_name.get().strip()
+    if current and current != auto_title:
+        log_output(f"Keeping typed filename (title: {title})")
+        return
+    entry_name.delete(0, tk.END)
+    entry_name.insert(0, title)
+    auto_title = title
+    log_output(f"✓ Title: {title}")
 
 # --- Function to clean filenames ---
 def clean_filename(name, ext):
@@ -214,184 +1060,2165 @@ def clean_filename(name, ext):
         name += ext
     return name
 
-# --- Threaded download function using subprocess ---
-def download_file_thread(url, filename, format_type="mp3"):
-    if not dependencies_ready:
-        root.after(0, lambda: messagebox.showwarning("Not Ready", "Dependencies are still loading. Please wait..."))
-        return
-    
-    if setup_error:
-        root.after(0, lambda: messagebox.showerror("Setup Error", f"Dependencies failed to load:\n{setup_error}"))
+# --- Download jobs ---
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_POSTPROCESSING = "post-processing"
+JOB_PAUSED = "paused"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+JOB_SETTLED_STATES = JOB_FINISHED_STATES + (JOB_PAUSED,)  # nothing left to do until resumed
+# Lower runs first. Interactive jobs (typed into the window) go ahead of bulk work
+# (playlists, batch files, resumed jobs) and may use INTERACTIVE_SLOTS beyond max_workers.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+INTERACTIVE_SLOTS = 1
+# Where a job's time goes, in order; see DownloadJob.enter_stage()
+JOB_STAGES = ("queue_wait", "extract", "download", "postprocess", "finalize")
+
+# yt-dlp prefixes its ffmpeg steps with these tags once the network part is over
+POSTPROCESS_TAGS = ("[ExtractAudio]", "[Merger]", "[ffmpeg]", "[VideoConvertor]", "[Fixup")
+
+# Notified on every job state change (queue panel, batch mode waiting for completion)
+jobs_changed = threading.Condition()
+
+# yt-dlp prints its progress dict as JSON behind this marker (--progress-template)
+PROGRESS_PREFIX = "PMD-PROGRESS "
+# Time constant (seconds) of the smoothed download rate
+RATE_SMOOTHING = 3.0
+# Output lines kept per job for classify_failure()
+OUTPUT_TAIL_LINES = 40
+
+def format_bytes(count):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if count < 1024 or unit == "GiB":
+            return f"{count:.1f} {unit}" if unit != "B" else f"{count:.0f} B"
+        count /= 1024
+
+def format_eta(seconds):
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+class DownloadJob:
+    """One download request and its current state"""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, filename=None, format_type="mp3", priority=PRIORITY_BULK):
+        # filename=None: named after the video title once the job runs
+        self.id = next(DownloadJob._ids)
+        self.priority = priority
+        self.url = url
+        self.host = url_host(url)
+        self.filename = filename
+        self.format_type = format_type
+        self.weight = float((settings.get("bandwidth_weights") or {}).get(format_type, 1.0))
+        self.out_path = os.path.join(path_music_dir, filename) if filename else None
+        self.output_paths = {}  # format -> file actually written, when the audio policy changed its extension
+        self.state = JOB_QUEUED
+        self.progress = 0.0
+        # Structured progress: per-file (downloaded, total) plus job-wide rates
+        self.files = {}
+        self.downloaded = 0
+        self.total = 0
+        self.rate = 0.0
+        self.smoothed_rate = 0.0
+        self.eta = None
+        self._rate_sample = None
+        self._progress_lock = threading.Lock()
+        self.returncode = None
+        self.error = None
+        self.bytes = 0
+        self.skipped = False  # satisfied from the library index
+        self.log_file = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.retries = 0
+        self.failure = None  # classify_failure() of the last failed run
+        self.not_before = 0.0  # monotonic time a retry may start
+        self.probe = False  # dispatched to test a paused host, see HostBreaker
+        self.output_tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        # Pause/cancel: the state asked for, and the processes to stop for it
+        self.stop_request = None
+        self.processes = set()
+        self.scratch_dir = None
+        self._control_lock = threading.Lock()
+        self.attempts = 0  # runs across sessions (job_store.sqlite3)
+        self.store_id = None
+        self.queue = None  # the DownloadQueue it was submitted to
+        # Seconds spent per stage; the running stage is charged when the next one begins
+        self.stages = dict.fromkeys(JOB_STAGES, 0.0)
+        self._stage = "queue_wait"
+        self._stage_started = time.monotonic()
+        self._stage_lock = threading.Lock()
+
+    def enter_stage(self, stage):
+        """Close the current stage's clock and start the next one (None: stop timing)"""
+        with self._stage_lock:
+            now = time.monotonic()
+            if self._stage is not None:
+                self.stages[self._stage] += now - self._stage_started
+            self._stage, self._stage_started = stage, now
+
+    def set_state(self, state):
+        with jobs_changed:
+            previous, self.state = self.state, state
+            if state == JOB_QUEUED:
+                self.enter_stage("queue_wait")
+            elif state == JOB_RUNNING:
+                self.started = self.started or time.time()
+                self.enter_stage("extract")
+            elif state == JOB_POSTPROCESSING:
+                self.enter_stage("postprocess")
+            elif state == JOB_PAUSED:
+                self.enter_stage(None)
+            elif state in JOB_FINISHED_STATES:
+                self.finished = time.time()
+                self.enter_stage(None)
+            if self.queue is not None:
+                self.queue.state_changed(self, previous)
+            jobs_changed.notify_all()
+        if self.store_id is not None:
+            job_store.save(self)
+        if state in JOB_FINISHED_STATES:
+            record_metrics(self)
+
+    def update_progress(self, d):
+        """Fold one yt-dlp progress dict (hook or --progress-template JSON) into the job"""
+        if d.get("status") not in ("downloading", "finished"):
+            return
+        if self._stage == "extract":
+            # First bytes: yt-dlp's extraction and format selection are over
+            self.enter_stage("download")
+        done = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+        if d["status"] == "finished":
+            total = total or done
+        with self._progress_lock:
+            # A video+audio download reports one file after the other
+            self.files[d.get("filename") or ""] = (done, total)
+            self.downloaded = sum(f[0] for f in self.files.values())
+            self.total = sum(f[1] for f in self.files.values())
+            now = time.monotonic()
+            if self._rate_sample is not None:
+                elapsed = now - self._rate_sample[0]
+                if elapsed >= 0.2:
+                    self.rate = max(0.0, (self.downloaded - self._rate_sample[1]) / elapsed)
+                    weight = 1 - math.exp(-elapsed / RATE_SMOOTHING)
+                    self.smoothed_rate += weight * (self.rate - self.smoothed_rate)
+                    self._rate_sample = (now, self.downloaded)
+            else:
+                self._rate_sample = (now, self.downloaded)
+                self.rate = self.smoothed_rate = float(d.get("speed") or 0.0)
+            if self.total:
+                self.progress = min(100.0, self.downloaded * 100 / self.total)
+                remaining = max(0, self.total - self.downloaded)
+                self.eta = remaining / self.smoothed_rate if self.smoothed_rate > 0 else None
+
+    def attach_process(self, process):
+        """Track a yt-dlp/ffmpeg process of this job; stopped at once if a stop is pending"""
+        with self._control_lock:
+            self.processes.add(process)
+            stopping = self.stop_request is not None
+        if stopping:
+            kill_process_tree(process)
+
+    def detach_process(self, process):
+        with self._control_lock:
+            self.processes.discard(process)
+
+    def kill_processes(self):
+        """Stop the job's processes without a stop request (a bandwidth re-rate relaunches them)"""
+        with self._control_lock:
+            processes = list(self.processes)
+        for process in processes:
+            kill_process_tree(process)
+
+    def request_stop(self, state):
+        """Ask the running job to end as JOB_PAUSED or JOB_CANCELLED; its worker settles it"""
+        with self._control_lock:
+            self.stop_request = state
+            processes = list(self.processes)
+        for process in processes:
+            kill_process_tree(process)
+
+    def reset_progress(self):
+        with self._progress_lock:
+            self.files.clear()
+            self.progress = 0.0
+            self.downloaded = self.total = 0
+            self.rate = self.smoothed_rate = 0.0
+            self.eta = None
+            self._rate_sample = None
+
+    def describe(self):
+        """One line for the queue panel"""
+        name = self.filename or self.url
+        wait = self.not_before - time.monotonic()
+        if self.state == JOB_QUEUED and wait > 0:
+            return f"[retry {self.retries} in {format_eta(wait)}] {self.format_type.upper()}  {name}"
+        if self.state == JOB_RUNNING and self.total:
+            return (f"[{self.state} {self.progress:.0f}% {format_bytes(self.smoothed_rate)}/s "
+                    f"ETA {format_eta(self.eta)}] {self.format_type.upper()}  {name}")
+        if self.state in (JOB_RUNNING, JOB_POSTPROCESSING):
+            return f"[{self.state} {self.progress:.0f}%] {self.format_type.upper()}  {name}"
+        if self.skipped:
+            return f"[{self.state}, in library] {self.format_type.upper()}  {name}"
+        return f"[{self.state}] {self.format_type.upper()}  {name}"
+
+    def summary(self):
+        """Machine-readable result for batch mode"""
+        wall_time = None
+        if self.started and self.finished:
+            wall_time = round(self.finished - self.started, 3)
+        return {
+            "url": self.url,
+            "format": self.format_type,
+            "filename": self.filename,
+            "path": self.out_path,
+            "status": self.state,
+            "bytes": self.bytes,
+            "skipped": self.skipped,
+            "wall_time": wall_time,
+            "returncode": self.returncode,
+            "error": self.error,
+            "failure": self.failure,
+            "retries": self.retries,
+            "stages": {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+        }
+
+    def metrics(self):
+        """The metrics.jsonl record for a finished job"""
+        return {
+            "time": round(self.finished or time.time(), 3),
+            "id": self.id,
+            "url": self.url,
+            "format": self.format_type,
+            "engine": active_engine(),
+            "status": self.state,
+            "returncode": self.returncode,
+            "error": self.error,
+            "bytes": self.bytes,
+            "failure": self.failure,
+            "retries": self.retries,
+            "skipped": self.skipped,
+            "stages": {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+            "total": round((self.finished or time.time()) - self.created, 3),
+        }
+
+FINISHED_JOBS_KEPT = 100  # finished jobs kept in the queue panel; older ones only add to counts()
+
+class DownloadQueue:
+    """Run download jobs on a bounded pool of worker threads"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, int(max_workers))
+        self.jobs = []
+        # Guarded by jobs_changed: jobs not yet in JOB_SETTLED_STATES, finished jobs oldest first,
+        # and the states of finished jobs dropped from self.jobs
+        self.unsettled = 0
+        self._finished = collections.deque()
+        self._dropped = collections.Counter()
+        self._pending = []
+        self._workers = []
+        self._idle = 0
+        self._cond = threading.Condition()
+
+    def submit(self, job):
+        if job.store_id is None:
+            job_store.attach(job)
+        with jobs_changed:
+            job.queue = self
+            if job.state not in JOB_SETTLED_STATES:
+                self.unsettled += 1
+        with self._cond:
+            self.jobs.append(job)
+            if job.state == JOB_QUEUED:
+                self._enqueue(job)
+        return job
+
+    def state_changed(self, job, previous):
+        """Book-keeping for a job's state change; called with jobs_changed held"""
+        self.unsettled += (previous in JOB_SETTLED_STATES) - (job.state in JOB_SETTLED_STATES)
+        if job.state in JOB_FINISHED_STATES and previous not in JOB_FINISHED_STATES:
+            self._finished.append(job)
+            while len(self._finished) > FINISHED_JOBS_KEPT:
+                old = self._finished.popleft()
+                self.jobs.remove(old)
+                self._dropped[old.state] += 1
+
+    def _enqueue(self, job):
+        # By priority, then in order of submission
+        self._pending.append(job)
+        self._pending.sort(key=lambda pending: (pending.priority, pending.id))
+        self._grow()
+        self._cond.notify_all()
+
+    def _unqueue(self, job):
+        """Take a job out of line; False if a worker has it already"""
+        with self._cond:
+            if job in self._pending:
+                self._pending.remove(job)
+                return True
+            return False
+
+    def cancel(self, job):
+        """Drop a waiting or paused job, or stop a running one; its partial files are deleted"""
+        if self._unqueue(job) or job.state == JOB_PAUSED:
+            remove_partial_files(job)
+            job.set_state(JOB_CANCELLED)
+            log_output(f"Cancelled #{job.id}", job)
+        elif job.state not in JOB_FINISHED_STATES:
+            job.request_stop(JOB_CANCELLED)
+
+    def pause(self, job):
+        """Take a job out of line, or stop its download and free the slot; resume() continues it"""
+        if self._unqueue(job):
+            job.set_state(JOB_PAUSED)
+        elif job.state == JOB_POSTPROCESSING:
+            log_output(f"#{job.id} has finished downloading, letting it complete", job)
+        elif job.state not in JOB_FINISHED_STATES + (JOB_PAUSED,):
+            job.request_stop(JOB_PAUSED)
+
+    def resume(self, job):
+        """Queue a paused job again; yt-dlp continues its partial file"""
+        if job.state != JOB_PAUSED:
+            return
+        job.not_before = 0.0
+        job.reset_progress()
+        job.set_state(JOB_QUEUED)
+        with self._cond:
+            self._enqueue(job)
+
+    def set_max_workers(self, count):
+        """Change the number of concurrent jobs; extra workers retire once idle"""
+        with self._cond:
+            self.max_workers = max(1, int(count))
+            self._grow()
+            self._cond.notify_all()
+
+    def _grow(self):
+        # Start workers only while the idle ones can't cover the pending jobs
+        while len(self._workers) < self.max_workers + INTERACTIVE_SLOTS and self._idle < len(self._pending):
+            worker = threading.Thread(target=self._work, daemon=True)
+            self._workers.append(worker)
+            self._idle += 1
+            worker.start()
+
+    def retry(self, job, delay):
+        """Put a failed job back in line; it may start again after delay seconds"""
+        job.not_before = time.monotonic() + delay
+        job.reset_progress()
+        job.set_state(JOB_QUEUED)
+        with self._cond:
+            self._enqueue(job)
+
+    def _take(self):
+        """Pop the first pending job allowed to start now; else (None, seconds until one may)"""
+        now = time.monotonic()
+        delay = None
+        busy = len(self._workers) - self._idle
+        for job in self._pending:
+            if busy >= self.max_workers + (INTERACTIVE_SLOTS if job.priority == PRIORITY_INTERACTIVE else 0):
+                continue
+            wait = host_breaker.wait_time(job.host)
+            if wait is not None:
+                wait = max(wait, job.not_before - now)
+                if wait <= 0:
+                    self._pending.remove(job)
+                    job.probe = host_breaker.admit(job.host)
+                    return job, None
+                delay = wait if delay is None else min(delay, wait)
+        return None, delay
+
+    def _work(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                while True:
+                    if len(self._workers) > self.max_workers + INTERACTIVE_SLOTS:
+                        self._idle -= 1
+                        self._workers.remove(me)
+                        return
+                    job, delay = self._take()
+                    if job is not None:
+                        break
+                    # Nothing may start yet: wait for a submit, a finished job or the next retry time
+                    self._cond.wait(delay)
+                self._idle -= 1
+            try:
+                download_file_thread(job)
+            except Exception as e:
+                job.error = str(e)
+                job.set_state(JOB_FAILED)
+            finally:
+                host_breaker.release(job)
+            with self._cond:
+                self._idle += 1
+                self._cond.notify_all()
+
+    def load(self):
+        """(workers busy with a job, jobs waiting to start)"""
+        with self._cond:
+            return len(self._workers) - self._idle, len(self._pending)
+
+    def counts(self):
+        """Number of jobs per state, including finished jobs no longer listed"""
+        with jobs_changed:
+            result = dict(self._dropped)
+        for job in list(self.jobs):
+            result[job.state] = result.get(job.state, 0) + 1
+        return result
+
+    def aggregate_progress(self):
+        """Bytes, rates and ETA summed over the running jobs"""
+        active = [job for job in list(self.jobs) if job.state in (JOB_RUNNING, JOB_POSTPROCESSING)]
+        downloaded = sum(job.downloaded for job in active)
+        total = sum(job.total for job in active)
+        smoothed_rate = sum(job.smoothed_rate for job in active if job.state == JOB_RUNNING)
+        eta = None
+        if total and smoothed_rate > 0:
+            eta = max(0, total - downloaded) / smoothed_rate
+        return {
+            "active": len(active),
+            "downloaded": downloaded,
+            "total": total,
+            "rate": sum(job.rate for job in active if job.state == JOB_RUNNING),
+            "smoothed_rate": smoothed_rate,
+            "eta": eta,
+        }
+
+    def wait(self):
+        """Block until every submitted job has finished or is paused"""
+        with jobs_changed:
+            while self.unsettled:
+                jobs_changed.wait()
+
+download_queue = DownloadQueue(settings["max_workers"])
+
+# --- Durable job store (job_store.sqlite3) ---
+# Every queued job has a row, so a crash or a closed window doesn't lose it: the next start
+# queues unfinished rows again under the same file names, and yt-dlp continues their .part files.
+JOB_STORE_KEEP_DAYS = 7  # finished rows are pruned after this
+FINISHED_STATES_SQL = "(" + ", ".join("?" * len(JOB_FINISHED_STATES)) + ")"
+
+class JobStore:
+    """SQLite record of every job: URL, format, target file name, state and attempts"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.claimed = set()  # row ids that belong to a job of this session
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT, format TEXT, filename TEXT, state TEXT, attempts INTEGER,
+                error TEXT, created REAL, updated REAL)""")
+            db.execute(f"DELETE FROM jobs WHERE state IN {FINISHED_STATES_SQL} AND updated < ?",
+                       JOB_FINISHED_STATES + (time.time() - JOB_STORE_KEEP_DAYS * 86400,))
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def attach(self, job):
+        """Give a new job its row: an unfinished one for the same URL and format if there is one"""
+        with self.lock, self._connect() as db:
+            rows = db.execute(f"SELECT id, filename, attempts FROM jobs WHERE url=? AND format=? "
+                              f"AND state NOT IN {FINISHED_STATES_SQL}",
+                              (job.url, job.format_type) + JOB_FINISHED_STATES).fetchall()
+            for row_id, filename, attempts in rows:
+                if row_id not in self.claimed and (not job.filename or not filename or job.filename == filename):
+                    # Same target name, so the partial download is picked up again
+                    if filename and not job.filename:
+                        job.filename = filename
+                        job.out_path = os.path.join(path_music_dir, filename)
+                    job.attempts = attempts
+                    break
+            else:
+                row_id = db.execute("INSERT INTO jobs (url, format, filename, state, attempts, created, updated) "
+                                    "VALUES (?, ?, ?, ?, 0, ?, ?)",
+                                    (job.url, job.format_type, job.filename, job.state, job.created, time.time())).lastrowid
+            self.claimed.add(row_id)
+        job.store_id = row_id
+
+    def save(self, job):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET filename=?, state=?, attempts=?, error=?, updated=? WHERE id=?",
+                       (job.filename, job.state, job.attempts, job.error, time.time(), job.store_id))
+
+    def unfinished(self):
+        """Rows of jobs an earlier session left queued, running or paused, oldest first"""
+        with self.lock, self._connect() as db:
+            rows = db.execute(f"SELECT id, url, format, filename, attempts, state FROM jobs "
+                              f"WHERE state NOT IN {FINISHED_STATES_SQL} ORDER BY id", JOB_FINISHED_STATES).fetchall()
+        return [row for row in rows if row[0] not in self.claimed]
+
+job_store = JobStore(os.path.join(os.getcwd(), "job_store.sqlite3"))
+
+def recover_jobs():
+    """Queue the jobs an earlier session didn't finish; returns them"""
+    jobs = []
+    for row_id, url, format_type, filename, attempts, state in job_store.unfinished():
+        job = DownloadJob(url, filename, format_type)
+        job.store_id, job.attempts = row_id, attempts
+        job_store.claimed.add(row_id)
+        if attempts >= settings["job_max_attempts"]:
+            # Keeps failing or taking the app down with it: give up instead of looping forever
+            job.state = JOB_FAILED
+            job.error = f"gave up after {attempts} attempts"
+            job_store.save(job)
+            remove_partial_files(job)
+            log_output(f"Not resuming {url}: {job.error}")
+            continue
+        if state == JOB_PAUSED:
+            job.state = JOB_PAUSED  # stays paused until resumed
+        jobs.append(download_queue.submit(job))
+    if jobs:
+        log_output(f"Resuming {len(jobs)} unfinished job(s) from the last session")
+    return jobs
+
+def setup_then_resume():
+    """Background start-up for the window: dependencies, then the last session's leftovers"""
+    setup_dependencies()
+    if dependencies_ready and not setup_error:
+        recover_jobs()
+
+# --- Retries and per-host circuit breaker ---
+# A failed run is classified from yt-dlp's exit code and last output lines. Transient and
+# throttled failures go back in the queue with jittered exponential backoff; throttling also
+# pauses the host, so its other queued jobs wait while downloads from other sites carry on.
+FAILURE_THROTTLED = "throttled"
+FAILURE_TRANSIENT = "transient"
+FAILURE_PERMANENT = "permanent"
+THROTTLE_PATTERN = re.compile(
+    r"HTTP Error 429|Too Many Requests|rate[- ]?limit|confirm you.re not a bot|HTTP Error 503", re.I)
+TRANSIENT_PATTERN = re.compile(
+    r"timed? ?out|Connection (reset|refused|aborted)|Remote end closed|IncompleteRead|"
+    r"Temporary failure in name resolution|Name or service not known|getaddrinfo failed|"
+    r"Network is unreachable|HTTP Error 5\d\d|Did not get any data blocks|giving up after \d+|"
+    r"EOF occurred in violation of protocol|UNEXPECTED_EOF_WHILE_READING|SSLZeroReturnError|"
+    r"BAD_RECORD_MAC|SSL: (DECRYPTION_FAILED|BAD_LENGTH)", re.I)
+# Retrying never fixes a certificate the TLS check rejects, even though it is an SSL error
+CERTIFICATE_PATTERN = re.compile(
+    r"CERTIFICATE_VERIFY_FAILED|certificate verify failed|self[- ]signed certificate|"
+    r"certificate has expired|hostname mismatch|doesn't match either of", re.I)
+
+def url_host(url):
+    """Host a job's requests go to, with www./m. dropped and youtu.be folded into youtube.com"""
+    host = (urllib.parse.urlparse(url.strip()).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return "youtube.com" if host == "youtu.be" else host
+
+def classify_failure(returncode, output):
+    """FAILURE_THROTTLED, FAILURE_TRANSIENT or FAILURE_PERMANENT for a failed yt-dlp run"""
+    # Judge by the ERROR lines when there are any: warnings about retried requests are noise
+    lines = [line for line in output if "ERROR" in line] or list(output)
+    text = "\n".join(lines)
+    if CERTIFICATE_PATTERN.search(text):
+        return FAILURE_PERMANENT
+    if THROTTLE_PATTERN.search(text):
+        return FAILURE_THROTTLED
+    if returncode > 0 and TRANSIENT_PATTERN.search(text):
+        return FAILURE_TRANSIENT
+    return FAILURE_PERMANENT
+
+def retry_delay(retries):
+    """Seconds before retry number retries + 1: exponential, jittered over the upper half"""
+    ceiling = min(settings["retry_max_seconds"], settings["retry_base_seconds"] * 2 ** retries)
+    return random.uniform(ceiling / 2, ceiling)
+
+class HostBreaker:
+    """Per-host circuit breaker: a throttled host takes no new jobs until its cooldown ends,
+    then a single probe job decides whether it opens up again or cools down for longer"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}  # host -> {"trips", "until" (monotonic), "probing"}
+
+    def wait_time(self, host):
+        """Seconds until a new job to host may start (None: once the probe job has reported)"""
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                return 0
+            if state["probing"]:
+                return None
+            return max(0.0, state["until"] - time.monotonic())
+
+    def admit(self, host):
+        """A job to host is starting; True if it is the probe of a paused host"""
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                return False
+            state["probing"] = True
+            return True
+
+    def record(self, job, failure):
+        """Outcome of a job's download (failure None: it worked)"""
+        with self.lock:
+            state = self.hosts.get(job.host)
+            now = time.monotonic()
+            if failure == FAILURE_THROTTLED:
+                # Jobs that were already running when the host tripped don't trip it again
+                if state is None or job.probe or (state["until"] <= now and not state["probing"]):
+                    trips = state["trips"] + 1 if state else 1
+                    cooldown = min(settings["host_cooldown_max_seconds"],
+                                   settings["host_cooldown_seconds"] * 2 ** (trips - 1))
+                    cooldown *= random.uniform(1.0, 1.2)
+                    self.hosts[job.host] = {"trips": trips, "until": now + cooldown, "probing": False}
+                    log_output(f"{job.host} is throttling downloads, pausing it for {cooldown:.0f}s", job)
+            elif state is not None and job.probe:
+                if failure is None:
+                    del self.hosts[job.host]
+                    log_output(f"{job.host} is accepting downloads again", job)
+                else:
+                    state["probing"] = False  # not the host's doing; the next job probes
+            job.probe = False
+
+    def release(self, job):
+        """The worker is done with the job; frees the probe slot if it never reported"""
+        if job.probe:
+            with self.lock:
+                state = self.hosts.get(job.host)
+                if state is not None:
+                    state["probing"] = False
+            job.probe = False
+
+host_breaker = HostBreaker()
+
+# --- Adaptive concurrency ---
+# Additive increase while a step up still buys throughput, multiplicative decrease on congestion
+# (throttling, encoders falling behind, CPU saturated). Each change gets one interval to settle
+# before its effect is judged.
+CONCURRENCY_SAMPLE_SECONDS = 1.0
+CONCURRENCY_MIN_GAIN = 0.05  # share of throughput one more download must add to be kept
+CONCURRENCY_HOLD_INTERVALS = 6  # intervals without stepping up after a decrease
+
+def cpu_times():
+    """(busy, total) CPU time of the whole machine so far; differences give the busy share"""
+    if sys.platform == "win32":
+        import ctypes
+        idle, kernel, user = ctypes.c_ulonglong(), ctypes.c_ulonglong(), ctypes.c_ulonglong()
+        if ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+            # Kernel time includes idle time
+            return kernel.value + user.value - idle.value, kernel.value + user.value
+    else:
+        try:
+            with open("/proc/stat") as f:
+                ticks = [int(field) for field in f.readline().split()[1:8]]
+            return sum(ticks) - ticks[3] - ticks[4], sum(ticks)  # minus idle and iowait
+        except (OSError, ValueError, IndexError):
+            pass
+    # Elsewhere: this process and its finished children (yt-dlp, ffmpeg) only
+    times = os.times()
+    return (times.user + times.system + times.children_user + times.children_system,
+            times.elapsed * (os.cpu_count() or 1))
+
+def cpu_busy(start, end):
+    """Busy share of all cores between two cpu_times() readings"""
+    total = end[1] - start[1]
+    return (end[0] - start[0]) / total if total > 0 else 0.0
+
+class ConcurrencyController:
+    """Moves download_queue.max_workers AIMD-style from observed throughput and congestion"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.throttled_runs = 0
+        self.baseline = None  # throughput before the last step up, until it is judged
+        self.hold = 0
+        self.settling = False
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def throttled(self):
+        """A download just failed with FAILURE_THROTTLED"""
+        with self.lock:
+            self.throttled_runs += 1
+
+    def _run(self):
+        samples = []
+        last, cpu_start = time.monotonic(), cpu_times()
+        while True:
+            time.sleep(CONCURRENCY_SAMPLE_SECONDS)
+            samples.append(download_queue.aggregate_progress()["rate"])
+            if time.monotonic() - last >= settings["concurrency_interval_seconds"]:
+                cpu_end = cpu_times()
+                self.adjust(sum(samples) / len(samples), cpu_busy(cpu_start, cpu_end))
+                samples = []
+                last, cpu_start = time.monotonic(), cpu_end
+
+    def adjust(self, throughput, cpu=0.0):
+        """One control step from the last interval's mean download rate and busy CPU share"""
+        with self.lock:
+            throttled, self.throttled_runs = self.throttled_runs, 0
+        current = download_queue.max_workers
+        busy, waiting = download_queue.load()
+        if self.settling and not throttled:
+            self.settling = False
+            return
+        low, high = settings["concurrency_min"], settings["concurrency_max"]
+        congestion = None
+        if throttled:
+            congestion = f"{throttled} throttled download(s)"
+        elif transcode_pool.backlog_full():
+            congestion = "transcode backlog full"
+        elif cpu > settings["concurrency_cpu_limit"]:
+            congestion = f"CPU {cpu:.0%} busy"
+        new, reason = current, None
+        if congestion:
+            new, reason = max(low, current // 2), congestion
+            self.baseline, self.hold = None, CONCURRENCY_HOLD_INTERVALS
+        elif self.baseline is not None and throughput < self.baseline * (1 + CONCURRENCY_MIN_GAIN):
+            new, reason = max(low, current - 1), "the last step added no throughput"
+            self.baseline, self.hold = None, CONCURRENCY_HOLD_INTERVALS
+        elif self.hold:
+            self.hold -= 1
+            self.baseline = None
+        elif busy >= current and waiting and current < high:
+            new, reason = current + 1, f"all {current} busy, {waiting} waiting"
+            self.baseline = throughput
+        else:
+            self.baseline = None
+        if new != current:
+            log_output(f"Parallel downloads {current} -> {new}: {reason} ({format_bytes(throughput)}/s)")
+            download_queue.set_max_workers(new)
+            self.settling = True
+
+concurrency = ConcurrencyController()
+
+# --- Job metrics (metrics.jsonl and the Prometheus endpoint) ---
+METRICS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class JobMetrics:
+    """Counters and per-stage histograms over every finished job"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.finished = collections.Counter()  # status -> jobs
+        self.bytes = 0
+        self.retries = 0
+        # name -> [bucket counts..., +Inf count], sum
+        self.histograms = {name: ([0] * (len(METRICS_BUCKETS) + 1), [0.0])
+                           for name in JOB_STAGES + ("total",)}
+
+    def observe(self, record):
+        with self.lock:
+            self.finished[record["status"]] += 1
+            self.bytes += record["bytes"] or 0
+            self.retries += record["retries"]
+            values = dict(record["stages"], total=record["total"])
+            for name, value in values.items():
+                counts, total = self.histograms[name]
+                counts[next((i for i, bound in enumerate(METRICS_BUCKETS) if value <= bound), len(METRICS_BUCKETS))] += 1
+                total[0] += value
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = [
+            "# HELP pmd_jobs_finished_total Finished download jobs by status.",
+            "# TYPE pmd_jobs_finished_total counter",
+        ]
+        with self.lock:
+            for status in JOB_FINISHED_STATES:
+                lines.append(f'pmd_jobs_finished_total{{status="{status}"}} {self.finished[status]}')
+            lines += [
+                "# HELP pmd_downloaded_bytes_total Bytes written by finished jobs.",
+                "# TYPE pmd_downloaded_bytes_total counter",
+                f"pmd_downloaded_bytes_total {self.bytes}",
+                "# HELP pmd_job_retries_total Download attempts beyond the first.",
+                "# TYPE pmd_job_retries_total counter",
+                f"pmd_job_retries_total {self.retries}",
+                "# HELP pmd_job_stage_seconds Time finished jobs spent per stage (stage=\"total\": whole job).",
+                "# TYPE pmd_job_stage_seconds histogram",
+            ]
+            for name, (counts, total) in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(METRICS_BUCKETS + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f'pmd_job_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'pmd_job_stage_seconds_sum{{stage="{name}"}} {total[0]:.3f}')
+                lines.append(f'pmd_job_stage_seconds_count{{stage="{name}"}} {cumulative}')
+        lines += ["# HELP pmd_jobs Jobs in the queue by current state.", "# TYPE pmd_jobs gauge"]
+        counts = download_queue.counts()
+        for state in (JOB_QUEUED, JOB_RUNNING, JOB_POSTPROCESSING):
+            lines.append(f'pmd_jobs{{state="{state}"}} {counts.get(state, 0)}')
+        return "\n".join(lines) + "\n"
+
+job_metrics = JobMetrics()
+metrics_file_lock = threading.Lock()
+
+def record_metrics(job):
+    """Append a finished job to metrics.jsonl and the endpoint's aggregates"""
+    record = job.metrics()
+    job_metrics.observe(record)
+    if not settings.get("metrics_file"):
         return
-    
-    # Clean URL
-    url = url.strip()
-    url = url.split("&list=")[0]  # Remove playlist parameter
-    
-    out_path = os.path.join(path_music_dir, filename)
-    
-    log_output(f"\n{'='*50}")
-    log_output(f"Starting download: {format_type.upper()}")
-    log_output(f"URL: {url}")
-    log_output(f"Output: {out_path}")
-    log_output(f"yt-dlp: {ytdlp_cmd}")
-    log_output(f"ffmpeg: {bin_path}")
-    log_output(f"{'='*50}\n")
+    line = json.dumps(record) + "\n"
+    with metrics_file_lock:
+        try:
+            with open(os.path.join(os.getcwd(), settings["metrics_file"]), "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            log_output(f"Could not write metrics: {e}")
+
+def start_metrics_server(port):
+    """Serve /metrics on localhost from a background thread"""
+    import http.server
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = job_metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log_output(f"Metrics: http://127.0.0.1:{server.server_address[1]}/metrics")
+    return server
+
+
+# --- yt-dlp command line for one download ---
+# --- Download tuning profiles ---
+# concurrent_fragments: DASH/HLS fragments fetched at once (-N)
+# http_chunk_size: split plain HTTP downloads into ranged requests of this size
+# buffer_size: download buffer; external_downloader(_args): e.g. "aria2c" and "-x 8 -s 8 -k 1M"
+TUNING_KEYS = ("concurrent_fragments", "http_chunk_size", "buffer_size",
+               "external_downloader", "external_downloader_args")
+TUNING_PROFILES = {
+    "single": {"concurrent_fragments": 1},
+    "balanced": {"concurrent_fragments": 4, "http_chunk_size": "10M", "buffer_size": "64K"},
+    "fast": {"concurrent_fragments": 8, "http_chunk_size": "10M", "buffer_size": "256K"},
+    "aria2c": {"external_downloader": "aria2c", "external_downloader_args": "-x 8 -s 8 -k 1M"},
+}
+
+def tuning_profiles():
+    """Built-in profiles with the ones from settings.json merged over them"""
+    profiles = {name: dict(profile) for name, profile in TUNING_PROFILES.items()}
+    for name, profile in (settings.get("tuning_profiles") or {}).items():
+        profiles.setdefault(name, {}).update(profile)
+    return profiles
+
+def download_tuning(name=None):
+    """The selected tuning profile, with every key present (None = yt-dlp's default)"""
+    profiles = tuning_profiles()
+    profile = profiles.get(name or settings["tuning_profile"]) or profiles["balanced"]
+    return {key: profile.get(key) for key in TUNING_KEYS}
+
+def tuning_args(tuning):
+    """yt-dlp CLI flags for a tuning profile"""
+    args = []
+    if tuning["concurrent_fragments"]:
+        args += ["-N", str(tuning["concurrent_fragments"])]
+    if tuning["http_chunk_size"]:
+        args += ["--http-chunk-size", str(tuning["http_chunk_size"])]
+    if tuning["buffer_size"]:
+        args += ["--buffer-size", str(tuning["buffer_size"])]
+    if tuning["external_downloader"]:
+        args += ["--downloader", tuning["external_downloader"]]
+        if tuning["external_downloader_args"]:
+            args += ["--downloader-args", f"{tuning['external_downloader']}:{tuning['external_downloader_args']}"]
+    return args
+
+def apply_tuning(params, tuning):
+    """Set a tuning profile on YoutubeDL params, the in-process twin of tuning_args()"""
+    from yt_dlp.utils import parse_bytes
+    for key in ("concurrent_fragment_downloads", "http_chunk_size", "buffersize",
+                "external_downloader", "external_downloader_args"):
+        params.pop(key, None)
+    if tuning["concurrent_fragments"]:
+        params["concurrent_fragment_downloads"] = int(tuning["concurrent_fragments"])
+    if tuning["http_chunk_size"]:
+        params["http_chunk_size"] = parse_bytes(str(tuning["http_chunk_size"]))
+    if tuning["buffer_size"]:
+        params["buffersize"] = parse_bytes(str(tuning["buffer_size"]))
+    if tuning["external_downloader"]:
+        name = tuning["external_downloader"]
+        params["external_downloader"] = {"default": name}
+        if tuning["external_downloader_args"]:
+            params["external_downloader_args"] = {name.lower(): shlex.split(tuning["external_downloader_args"])}
+
+# --- Bandwidth governor ---
+# One budget (bytes/s) shared by all running downloads in proportion to their weights.
+# In-process jobs are throttled live from the progress hook. A yt-dlp process (the subprocess
+# engine, always used by the frozen build) gets a fixed --limit-rate at launch: its share among the
+# running jobs, at most what the other processes leave of the cap (granted). When jobs start or
+# finish, or a schedule window begins, a process whose rate is far off its share is stopped and
+# launched again at the new rate; yt-dlp continues its .part file.
+BANDWIDTH_RECHECK = 30  # seconds between time-of-day schedule checks
+MIN_GRANT_SHARE = 0.25  # a new process waits until this much of its fair share is free
+RERATE_TOLERANCE = 0.25  # a process is re-rated once its rate is this far off its share
+RERATE_MIN_SECONDS = 10  # ... and has run this long at the current rate
+
+def parse_rate(value):
+    """Bytes per second from 4000000, "500K", "4M", "4MiB/s" or "1.5G"; None/empty means unlimited"""
+    if value in (None, "", 0):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().upper().replace(" ", "")
+    text = text[:-2] if text.endswith("/S") else text
+    text = text.rstrip("B").rstrip("I")
+    multiplier = 1
+    if text and text[-1] in "KMG":
+        multiplier = 1024 ** ("KMG".index(text[-1]) + 1)
+        text = text[:-1]
+    return float(text) * multiplier
+
+def scheduled_limit(now=None):
+    """The bandwidth cap in force right now: the first matching schedule window, else bandwidth_limit"""
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for window in settings.get("bandwidth_schedule") or []:
+        start_h, start_m = map(int, window["from"].split(":"))
+        end_h, end_m = map(int, window["to"].split(":"))
+        start, end = start_h * 60 + start_m, end_h * 60 + end_m
+        # A window like 22:00-06:00 wraps past midnight
+        inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+        if inside:
+            return parse_rate(window.get("limit"))
+    return parse_rate(settings.get("bandwidth_limit"))
+
+def check_bandwidth_settings():
+    """Drop a bandwidth_limit or schedule window that doesn't parse, so downloads don't fail on it"""
+    try:
+        parse_rate(settings.get("bandwidth_limit"))
+    except ValueError:
+        log_output(f"Ignoring bandwidth_limit {settings['bandwidth_limit']!r}: use e.g. 500K, 4M or 1.5G; unlimited for now")
+        settings["bandwidth_limit"] = None
+    windows = []
+    for window in settings.get("bandwidth_schedule") or []:
+        try:
+            for field in ("from", "to"):
+                hours, minutes = map(int, window[field].split(":"))
+            parse_rate(window.get("limit"))
+        except (KeyError, TypeError, AttributeError, ValueError):
+            log_output(f"Ignoring bandwidth_schedule entry {window!r}: expected "
+                       '{"from": "HH:MM", "to": "HH:MM", "limit": "1M"}')
+            continue
+        windows.append(window)
+    settings["bandwidth_schedule"] = windows
+
+check_bandwidth_settings()
+
+class TokenBucket:
+    """Token bucket holding up to one second of its rate; consume() sleeps off any debt"""
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.tokens = rate or 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            if rate:
+                self.tokens = min(self.tokens, rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount):
+        with self.lock:
+            if not self.rate:
+                return
+            self._refill()
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+class BandwidthGovernor:
+    """Splits the scheduled cap among active jobs by weight and rebalances on start/finish"""
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.active = {}  # job -> [TokenBucket, bytes already charged]
+        self.granted = {}  # job -> [fixed --limit-rate of its yt-dlp process, monotonic launch time]
+        self.rerating = set()  # jobs whose process was stopped to be launched at a new rate
+        self.limit = None
+        self._checked = 0.0
+
+    def start(self, job):
+        with self.lock:
+            self.active[job] = [TokenBucket(), 0]
+            self._rebalance()
 
+    def finish(self, job):
+        with self.lock:
+            self.granted.pop(job, None)
+            self.rerating.discard(job)
+            if self.active.pop(job, None) is not None:
+                self._rebalance()
+            self.lock.notify_all()
+
+    def _rebalance(self):
+        self.limit = scheduled_limit()
+        self._checked = time.monotonic()
+        self._rerate()
+        # Live jobs share what the fixed grants leave; a small floor keeps them moving if nothing is left
+        live = [job for job in self.active if job not in self.granted]
+        if self.limit:
+            budget = max(self.limit - sum(grant[0] for grant in self.granted.values()), self.limit * 0.05)
+        total_weight = sum(job.weight for job in live) or 1.0
+        for job in live:
+            self.active[job][0].set_rate(budget * job.weight / total_weight if self.limit else None)
+
+    def _rerate(self):
+        """Stop the processes whose fixed rate is far off their share; run_download relaunches them"""
+        total_weight = sum(job.weight for job in self.active) or 1.0
+        now = time.monotonic()
+        for job, (rate, launched) in list(self.granted.items()):
+            if now - launched < RERATE_MIN_SECONDS:
+                continue
+            if self.limit:
+                share = self.limit * job.weight / total_weight
+                if abs(rate - share) <= share * RERATE_TOLERANCE:
+                    continue
+            if job.state != JOB_RUNNING or job.stop_request is not None:
+                continue  # the download is over, or the job is being stopped anyway
+            del self.granted[job]
+            self.rerating.add(job)
+            job.kill_processes()
+
+    def launch_rate(self, job):
+        """Fixed --limit-rate for a job's next yt-dlp process; waits for free budget"""
+        with self.lock:
+            self.rerating.discard(job)
+            waited = False
+            while True:
+                # Makes room first: processes above their share now are stopped for a re-rate
+                self._rebalance()
+                if not self.limit:
+                    return None
+                fair = self.limit * job.weight / sum(j.weight for j in self.active)
+                free = self.limit - sum(grant[0] for grant in self.granted.values())
+                if job.stop_request is not None:
+                    return None  # paused or cancelled while waiting; the process is stopped at launch
+                if free >= fair * MIN_GRANT_SHARE:
+                    rate = min(fair, free)
+                    self.granted[job] = [rate, time.monotonic()]
+                    self._rebalance()
+                    return rate
+                if not waited:
+                    log_output(f"Waiting for bandwidth: {format_bytes(max(0, free))}/s of "
+                               f"{format_bytes(self.limit)}/s free", job)
+                    waited = True
+                self.lock.wait(1.0)
+
+    def restarting(self, job):
+        """True if the job's process was stopped by a re-rate, not by the user or an error"""
+        with self.lock:
+            return job in self.rerating and job.stop_request is None
+
+    def recheck(self):
+        """Pick up a schedule change while only yt-dlp processes are running (see BANDWIDTH_RECHECK)"""
+        with self.lock:
+            if time.monotonic() - self._checked > BANDWIDTH_RECHECK:
+                self._rebalance()
+
+    def throttle(self, job):
+        """Charge the job's newly downloaded bytes against its share, sleeping if it is ahead"""
+        with self.lock:
+            entry = self.active.get(job)
+            if entry is None:
+                return
+            if time.monotonic() - self._checked > BANDWIDTH_RECHECK:
+                self._rebalance()
+            # A video+audio download starts counting again for the second file
+            amount = job.downloaded - entry[1] if job.downloaded >= entry[1] else job.downloaded
+            entry[1] = job.downloaded
+        entry[0].consume(amount)
+
+bandwidth = BandwidthGovernor()
+
+def build_ytdlp_cmd(url, out_path, format_type="mp3", info_json=None):
+    # With an info JSON from the title lookup yt-dlp skips extraction entirely
+    source = ["--load-info-json", info_json] if info_json else [url]
     if format_type == "mp3":
-        cmd = [
+        return [
             ytdlp_cmd,
             "-x",
-            "--audio-format", "mp3",
+            "-f", AUDIO_FORMATS[audio_policy()],
+            "--audio-format", AUDIO_FORMAT_ARGS[audio_policy()],
             "--audio-quality", "0",
             "--ffmpeg-location", bin_path,
             "-o", out_path,
             "--newline",
+            "--progress-template", "download:" + PROGRESS_PREFIX + "%(progress)j",
             "--no-playlist",
             "--extractor-args", "youtube:player_client=android,web",
-            url
-        ]
-    else:
-        cmd = [
+        ] + tuning_args(download_tuning()) + source
+    if format_type == "audio":
+        # Best audio stream as-is; the transcode stage makes the MP3
+        return [
             ytdlp_cmd,
-            "-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
+            "-f", AUDIO_FORMATS[audio_policy()],
             "--ffmpeg-location", bin_path,
             "-o", out_path,
             "--newline",
+            "--progress-template", "download:" + PROGRESS_PREFIX + "%(progress)j",
             "--no-playlist",
             "--extractor-args", "youtube:player_client=android,web",
-            url
+        ] + tuning_args(download_tuning()) + source
+    return [
+        ytdlp_cmd,
+        "-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
+        "--ffmpeg-location", bin_path,
+        "-o", out_path,
+        "--newline",
+        "--progress-template", "download:" + PROGRESS_PREFIX + "%(progress)j",
+        "--no-playlist",
+        "--extractor-args", "youtube:player_client=android,web",
+    ] + tuning_args(download_tuning()) + source
+
+def kill_process_tree(process):
+    """Stop a yt-dlp or ffmpeg process together with everything it started"""
+    if process.poll() is not None:
+        return
+    if sys.platform == 'win32':
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True,
+                       creationflags=subprocess.CREATE_NO_WINDOW)
+    else:
+        # Started in a session of its own, so its process group is the whole tree
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+def remove_partial_files(job):
+    """Delete what a cancelled job leaves behind: its scratch folder and yt-dlp's partial files"""
+    import glob
+    scratch_dir = job.scratch_dir
+    if scratch_dir is None and job.store_id is not None:
+        # Paused before this session ran it (or never started): the folder is named after the row
+        scratch_dir = os.path.join(path_music_dir, SCRATCH_DIR_NAME, f"job-{job.store_id}")
+    if scratch_dir:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    if not job.out_path:
+        return
+    for path in glob.glob(glob.escape(os.path.splitext(job.out_path)[0]) + ".*"):
+        name = os.path.basename(path)
+        if name.endswith((".part", ".ytdl")) or ".part-Frag" in name or ".temp." in name:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def settle_stopped_job(job):
+    """A paused or cancelled job's processes have stopped: keep or delete its partial files"""
+    state, job.stop_request = job.stop_request, None
+    if state == JOB_CANCELLED:
+        remove_partial_files(job)
+        log_output(f"Cancelled #{job.id}", job)
+    else:
+        log_output(f"Paused #{job.id}, the partial download is kept", job)
+    job.reset_progress()
+    job.set_state(state)
+
+def run_ytdlp(job, cmd):
+    """Run one yt-dlp process for a job, following its output; returns the exit code"""
+    log_output(f"Command: {' '.join(cmd)}\n", job)
+    
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0,
+        start_new_session=sys.platform != 'win32'
+    )
+    job.attach_process(process)
+    
+    for line in process.stdout:
+        line = line.strip()
+        if line.startswith(PROGRESS_PREFIX):
+            # Progress events update the job only; the GUI polls the totals
+            try:
+                job.update_progress(json.loads(line[len(PROGRESS_PREFIX):]))
+            except ValueError:
+                pass
+            bandwidth.recheck()
+        elif line:
+            log_output(line, job)
+            
+            if line.startswith(POSTPROCESS_TAGS) and job.state == JOB_RUNNING:
+                job.set_state(JOB_POSTPROCESSING)
+    
+    process.wait()
+    job.detach_process(process)
+    log_output(f"\nProcess finished with code: {process.returncode}", job)
+    return process.returncode
+
+# --- In-process yt-dlp engine ---
+# One warm YoutubeDL per worker thread and format, so extractors and the HTTP session are reused
+engine_local = threading.local()
+
+def active_engine():
+    """Engine used for new jobs ("inprocess" or "subprocess")"""
+    engine = settings["engine"]
+    if engine == "auto":
+        engine = "subprocess" if is_frozen() else "inprocess"
+    if engine == "inprocess" and importlib.util.find_spec("yt_dlp") is None:
+        engine = "subprocess"
+    return engine
+
+class EngineLogger:
+    """Routes yt-dlp messages to the console like the CLI output"""
+
+    def __init__(self, current):
+        self.current = current
+
+    def debug(self, msg):
+        if not msg.startswith("[debug] "):
+            log_output(msg, self.current["job"])
+
+    def info(self, msg):
+        log_output(msg, self.current["job"])
+
+    def warning(self, msg):
+        log_output(f"WARNING: {msg}", self.current["job"])
+
+    def error(self, msg):
+        log_output(msg, self.current["job"])
+
+def engine_progress_hook(job, d):
+    if job is not None and job.stop_request is not None:
+        from yt_dlp.utils import DownloadCancelled
+        raise DownloadCancelled(f"{job.stop_request} by the user")
+    if job is not None:
+        job.update_progress(d)
+        bandwidth.throttle(job)
+
+def engine_postprocessor_hook(job, d):
+    if job is not None and d["status"] == "started" and job.state == JOB_RUNNING:
+        job.set_state(JOB_POSTPROCESSING)
+
+def ytdlp_options(format_type):
+    """YoutubeDL params matching build_ytdlp_cmd()"""
+    opts = {
+        "outtmpl": {"default": "%(title)s.%(ext)s"},
+        "ffmpeg_location": bin_path,
+        "noplaylist": True,
+        "quiet": True,
+        "noprogress": True,
+        "extractor_args": {"youtube": {"player_client": ["android", "web"]}},
+    }
+    if format_type == "mp3":
+        opts["format"] = AUDIO_FORMATS[audio_policy()]
+        opts["postprocessors"] = [
+            {"key": "FFmpegExtractAudio", "preferredcodec": AUDIO_FORMAT_ARGS[audio_policy()], "preferredquality": "0"},
         ]
+    elif format_type == "audio":
+        opts["format"] = AUDIO_FORMATS[audio_policy()]
+    else:
+        opts["format"] = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+    return opts
 
+def warm_ytdlp(format_type):
+    """This worker thread's YoutubeDL for a format and its current-job slot"""
+    import yt_dlp
+    instances = engine_local.__dict__.setdefault("instances", {})
+    # The audio policy is baked into the format selection and postprocessors
+    key = (format_type, audio_policy())
+    if key not in instances:
+        # Hooks may fire on yt-dlp's fragment threads, so they get the job via the slot
+        current = {"job": None}
+        opts = ytdlp_options(format_type)
+        opts["logger"] = EngineLogger(current)
+        opts["progress_hooks"] = [lambda d: engine_progress_hook(current["job"], d)]
+        opts["postprocessor_hooks"] = [lambda d: engine_postprocessor_hook(current["job"], d)]
+        instances[key] = (yt_dlp.YoutubeDL(opts), current)
+    return instances[key]
+
+def run_ytdlp_inprocess(job, url, out_path, format_type, info_json=None):
+    """Run one download through the yt_dlp API; returns an exit code like the CLI"""
+    from yt_dlp.utils import DownloadError, DownloadCancelled
+    ydl, current = warm_ytdlp(format_type)
+    ydl.params["outtmpl"]["default"] = out_path
+    ydl._download_retcode = 0
+    apply_tuning(ydl.params, download_tuning())
+    current["job"] = job
+    log_output(f"Engine: in-process yt_dlp ({'info JSON' if info_json else url})\n", job)
     try:
-        log_output(f"Command: {' '.join(cmd)}\n")
-        
+        if info_json:
+            returncode = ydl.download_with_info_file(info_json)
+        else:
+            returncode = ydl.download([url])
+    except (DownloadError, DownloadCancelled):
+        returncode = 1
+    finally:
+        current["job"] = None
+    log_output(f"\nProcess finished with code: {returncode}", job)
+    return returncode
+
+def run_download(job, url, out_path, format_type, info_json=None):
+    """Download with the configured engine under the bandwidth budget; returns the exit code"""
+    job.output_tail.clear()
+    if job.stop_request is not None:
+        return 1
+    wait_for_ytdlp_upgrade(job)
+    bandwidth.start(job)
+    try:
+        if active_engine() == "inprocess":
+            return run_ytdlp_inprocess(job, url, out_path, format_type, info_json)
+        cmd = build_ytdlp_cmd(url, out_path, format_type, info_json)
+        while True:
+            rate = bandwidth.launch_rate(job)
+            returncode = run_ytdlp(job, cmd + ["--limit-rate", str(int(rate))] if rate else cmd)
+            if not bandwidth.restarting(job):
+                return returncode
+            log_output(f"Bandwidth share changed, continuing #{job.id} at the new rate", job)
+    finally:
+        bandwidth.finish(job)
+
+# --- Transcode stage ---
+# Downloads that need ffmpeg work land in a scratch folder and are handed to a separate
+# pool sized to the cores, so download slots go back to the network straight away.
+# A "both" job fetches the merged MP4 once; its MP4 is remuxed and its MP3 transcoded
+# from those same bytes by two ffmpeg processes running side by side.
+SCRATCH_DIR_NAME = ".scratch"
+
+def output_formats(format_type):
+    """The files a job produces, main one first"""
+    return ("mp4", "mp3") if format_type == "both" else (format_type,)
+
+def output_path(job, fmt):
+    """Where a job's file in one format goes; a "both" job's two files share a name"""
+    if fmt in job.output_paths:
+        return job.output_paths[fmt]
+    if job.format_type != "both":
+        return job.out_path
+    return os.path.splitext(job.out_path)[0] + "." + fmt
+
+def ffmpeg_path():
+    return os.path.join(bin_path, "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg")
+
+# --- Audio output policy ---
+# Stream selection per policy, so the copy path is the one that usually applies
+AUDIO_FORMATS = {
+    "mp3": "bestaudio/best",
+    "copy-if-compatible": "bestaudio[acodec^=mp4a]/bestaudio[acodec=mp3]/bestaudio/best",
+    "native": "bestaudio/best",
+}
+# yt-dlp -x equivalents for the in-yt-dlp conversion (transcode_workers = 0)
+AUDIO_FORMAT_ARGS = {"mp3": "mp3", "copy-if-compatible": "m4a>m4a/mp3>mp3/mp3", "native": "best"}
+AUDIO_CONTAINERS = {"aac": "m4a", "alac": "m4a", "mp3": "mp3", "opus": "opus", "vorbis": "ogg", "flac": "flac"}
+COMPATIBLE_CODECS = ("aac", "mp3")
+MUXERS = {"m4a": "mp4", "mp3": "mp3", "opus": "opus", "ogg": "ogg", "flac": "flac"}
+
+def audio_policy():
+    policy = settings["audio_policy"]
+    return policy if policy in AUDIO_FORMATS else "mp3"
+
+def probe_audio_codec(source):
+    """Codec name of the first audio stream ("aac", "opus", ...), read from ffmpeg's banner"""
+    result = subprocess.run(
+        [ffmpeg_path(), "-hide_banner", "-i", source],
+        capture_output=True, text=True, encoding='utf-8', errors='replace',
+        creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+    )
+    match = re.search(r"Stream #.*?Audio: (\w+)", result.stderr)
+    return match.group(1) if match else None
+
+def audio_plan(codec, policy):
+    """(extension, stream copy?) for audio in a given codec under a policy"""
+    if codec == "mp3":
+        return "mp3", True
+    if policy == "native" and codec in AUDIO_CONTAINERS:
+        return AUDIO_CONTAINERS[codec], True
+    if policy == "copy-if-compatible" and codec in COMPATIBLE_CODECS:
+        return AUDIO_CONTAINERS[codec], True
+    return "mp3", False
+
+def policy_extensions(fmt):
+    """File extensions a job in this format may end up with under the current audio policy"""
+    if fmt != "mp3":
+        return (fmt,)
+    policy = audio_policy()
+    if policy == "native":
+        return tuple(set(AUDIO_CONTAINERS.values()))
+    if policy == "copy-if-compatible":
+        return tuple(AUDIO_CONTAINERS[codec] for codec in COMPATIBLE_CODECS)
+    return ("mp3",)
+
+def library_file(key, fmt):
+    """Indexed file for a video in one format, if it is what the audio policy would produce now"""
+    path = library_index.lookup(key, fmt)
+    if path is None or os.path.splitext(path)[1][1:].lower() not in policy_extensions(fmt):
+        # e.g. an .opus kept under "native" doesn't satisfy a request for a real MP3
+        return None
+    return path
+
+def derive_command(source, target, ext, copy_audio=False):
+    """ffmpeg command writing one output file (by extension) from the fetched file"""
+    cmd = [ffmpeg_path(), "-y", "-v", "error", "-i", source]
+    if ext == "mp4":
+        return cmd + ["-map", "0", "-c", "copy", "-movflags", "+faststart", "-f", "mp4", target]
+    cmd += ["-vn", "-map", "0:a:0"]
+    if copy_audio:
+        cmd += ["-c:a", "copy"]
+    else:
+        # Same encoder settings as yt-dlp's --audio-format mp3 --audio-quality 0
+        cmd += ["-c:a", "libmp3lame", "-q:a", "0"]
+    if ext == "m4a":
+        cmd += ["-movflags", "+faststart"]
+    return cmd + ["-f", MUXERS[ext], target]
+
+def derive_outputs(job, source):
+    """Write every output of a job from one fetched file, in parallel"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def derive(fmt):
+        target = output_path(job, fmt)
+        ext, copy_audio = fmt, False
+        if fmt == "mp3":
+            ext, copy_audio = audio_plan(probe_audio_codec(source), audio_policy())
+            if ext != "mp3":
+                target = os.path.splitext(target)[0] + "." + ext
+        partial = target + ".part"
         process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+            derive_command(source, partial, ext, copy_audio),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace',
+            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0,
+            start_new_session=sys.platform != 'win32'
         )
+        job.attach_process(process)
+        stderr = process.communicate()[1]
+        job.detach_process(process)
+        if process.returncode != 0:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise RuntimeError(f"ffmpeg could not make the {ext.upper()}: {stderr.strip()[-500:]}")
+        os.replace(partial, target)
+        job.output_paths[fmt] = target
+        if job.format_type == fmt:
+            job.out_path, job.filename = target, os.path.basename(target)
+        log_output(f"✓ {ext.upper()} written ({'copied' if copy_audio else 'encoded' if fmt == 'mp3' else 'remuxed'}): {target}", job)
+        return target
+
+    formats = output_formats(job.format_type)
+    with ThreadPoolExecutor(max_workers=len(formats)) as pool:
+        return list(pool.map(derive, formats))
+
+def fetched_file(scratch_dir):
+    """The file yt-dlp left in a job's scratch folder"""
+    for name in os.listdir(scratch_dir):
+        if name.startswith("source.") and not name.endswith((".part", ".ytdl")):
+            return os.path.join(scratch_dir, name)
+    raise RuntimeError("yt-dlp reported success but left no file behind")
+
+class TranscodePool:
+    """Encoder threads, each driving one ffmpeg process, fed through a bounded handoff queue"""
+
+    def __init__(self):
+        self._handoff = None
+        self._lock = threading.Lock()
+
+    def backlog_full(self):
+        """True while finished downloads are blocked waiting for an encoder"""
+        return self._handoff is not None and self._handoff.full()
+
+    def workers(self):
+        return settings["transcode_workers"] if settings["transcode_workers"] is not None else (os.cpu_count() or 1)
+
+    def submit(self, task):
+        """Queue task(); blocks the calling download slot while the backlog is full"""
+        with self._lock:
+            if self._handoff is None:
+                count = max(1, self.workers())
+                backlog = settings["transcode_backlog"] or 2 * count
+                self._handoff = queue.Queue(maxsize=max(1, backlog))
+                for _ in range(count):
+                    threading.Thread(target=self._work, daemon=True).start()
+        self._handoff.put(task)
+
+    def _work(self):
+        while True:
+            task = self._handoff.get()
+            try:
+                task()
+            except Exception as e:
+                # transcode_stage settles its job itself; this only keeps the encoder alive
+                log_output(f"ERROR in the transcode stage: {e}")
+            finally:
+                self._handoff.task_done()
+
+transcode_pool = TranscodePool()
+
+def transcode_stage(job, key, source, scratch_dir):
+    """Runs on the transcode pool: make the job's files from the download, then finish it"""
+    try:
+        try:
+            if job.stop_request is None:
+                derive_outputs(job, source)
+        finally:
+            # Cleaned up before the job counts as finished, so a batch run leaves nothing behind
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if job.stop_request is not None:
+            settle_stopped_job(job)
+        else:
+            finish_job(job, key)
+    except Exception as e:
+        # Also covers finishing (library index, job store): the job must not stay post-processing
+        log_output(f"\nERROR: {e}", job)
+        job.error = str(e)
+        job.set_state(JOB_FAILED)
+        message = f"{job.filename}\n\n{e}"
+        ui_after(lambda: messagebox.showerror("Conversion failed", message))
+    finally:
+        close_job_log(job)
+
+def finish_job(job, key):
+    """Record a job's files in the library and mark it done"""
+    job.enter_stage("finalize")
+    job.progress = 100.0
+    job.bytes = 0
+    for fmt in output_formats(job.format_type):
+        path = output_path(job, fmt)
+        if os.path.exists(path):
+            job.bytes += os.path.getsize(path)
+            library_index.record(key, fmt, path)
+    job.set_state(JOB_DONE)
+    log_output(f"✓ Saved as: {job.out_path}", job)
+
+def close_job_log(job):
+    if job.log_file is not None:
+        job.log_file.close()
+        job.log_file = None
+
+# --- Download function run by the queue workers ---
+def download_file_thread(job):
+    url = job.url
+    format_type = job.format_type
+    
+    # Clean URL
+    url = url.strip()
+    url = url.split("&list=")[0]  # Remove playlist parameter
+    
+    job.attempts += 1
+    job.set_state(JOB_RUNNING)
+    
+    # Already in the library: done without any network work
+    key = library_key(url)
+    formats = output_formats(format_type)
+    existing = {fmt: library_file(key, fmt) for fmt in formats}
+    if all(existing.values()):
+        if not job.filename:
+            job.filename = os.path.basename(existing[formats[0]])
+            job.out_path = existing[formats[0]]
+        job.bytes = 0
+        for fmt in formats:
+            target = output_path(job, fmt)
+            ext = os.path.splitext(existing[fmt])[1]
+            if os.path.splitext(target)[1].lower() != ext.lower():
+                # e.g. an .m4a kept by the audio policy: the link keeps its real extension
+                target = os.path.splitext(target)[0] + ext
+                job.output_paths[fmt] = target
+                if fmt == format_type:
+                    job.out_path, job.filename = target, os.path.basename(target)
+            if os.path.abspath(target) != os.path.abspath(existing[fmt]):
+                if os.path.exists(target):
+                    log_output(f"Already downloaded as {existing[fmt]}; {target} exists, leaving it alone", job)
+                else:
+                    link_or_copy(existing[fmt], target)
+                    log_output(f"Already downloaded, linked {existing[fmt]} -> {target}", job)
+            else:
+                log_output(f"Already downloaded: {existing[fmt]}", job)
+            job.bytes += os.path.getsize(target)
+        job.skipped = True
+        job.progress = 100.0
+        job.returncode = 0
+        job.set_state(JOB_DONE)
+        return
+    
+    if not job.filename:
+        try:
+            title = get_video_info(url).get("title") or f"download-{job.id}"
+        except Exception as e:
+            log_output(f"Could not fetch title: {e}")
+            title = f"download-{job.id}"
+        job.filename = clean_filename(title, "." + formats[0])
+        job.out_path = os.path.join(path_music_dir, job.filename)
+        if job.store_id is not None:
+            job_store.save(job)
+    out_path = job.out_path
+    # MP3 and "both": download into a scratch folder, the transcode stage makes the files
+    scratch_dir = None
+    handed_off = False
+    fetch_format, fetch_path = format_type, out_path
+    if format_type == "both" or (format_type == "mp3" and transcode_pool.workers() > 0):
+        scratch_root = os.path.join(path_music_dir, SCRATCH_DIR_NAME)
+        os.makedirs(scratch_root, exist_ok=True)
+        if job.store_id is not None:
+            # Named after the stored job, so a resumed job finds its partial download
+            scratch_dir = os.path.join(scratch_root, f"job-{job.store_id}")
+            os.makedirs(scratch_dir, exist_ok=True)
+        else:
+            scratch_dir = tempfile.mkdtemp(prefix=f"job-{job.id}-", dir=scratch_root)
+        job.scratch_dir = scratch_dir
+        fetch_format = "audio" if format_type == "mp3" else "mp4"
+        fetch_path = os.path.join(scratch_dir, "source.%(ext)s")
+    elif format_type == "mp3":
+        # yt-dlp -x names the file after what the audio policy left it as
+        fetch_path = os.path.splitext(out_path)[0] + ".%(ext)s"
+    info_json = fresh_info_json(url)
+    if settings["job_log_files"]:
+        job.log_file = open_job_log(job)
+    
+    log_output(f"\n{'='*50}", job)
+    log_output(f"Starting download: {format_type.upper()}", job)
+    log_output(f"URL: {url}", job)
+    log_output(f"Output: {' + '.join(output_path(job, fmt) for fmt in formats)}", job)
+    log_output(f"yt-dlp: {ytdlp_cmd}" if active_engine() == "subprocess" else "yt-dlp: in-process", job)
+    log_output(f"ffmpeg: {bin_path}", job)
+    if info_json:
+        log_output(f"Info JSON: {info_json}", job)
+    log_output(f"{'='*50}\n", job)
+
+    try:
+        returncode = run_download(job, url, fetch_path, fetch_format, info_json)
+        if returncode != 0 and info_json and job.stop_request is None and classify_failure(returncode, job.output_tail) != FAILURE_THROTTLED:
+            # e.g. the signed format URLs were revoked early: extract again from the URL
+            log_output("Download from cached info failed, retrying with a fresh extraction...", job)
+            job.retries += 1
+            job.progress = 0.0
+            job.files.clear()
+            if job.state == JOB_POSTPROCESSING:
+                job.set_state(JOB_RUNNING)
+            returncode = run_download(job, url, fetch_path, fetch_format)
+        if job.stop_request is not None:
+            if job.stop_request == JOB_PAUSED:
+                scratch_dir = None  # resume() continues from the partial download in it
+            settle_stopped_job(job)
+            return
+        job.returncode = returncode
+        job.failure = classify_failure(returncode, job.output_tail) if returncode != 0 else None
+        host_breaker.record(job, job.failure)
+        if job.failure == FAILURE_THROTTLED:
+            concurrency.throttled()
         
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                log_output(line)
-                
-                if "%" in line:
-                    try:
-                        perc = line.split("%")[0].split()[-1]
-                        root.after(0, lambda p=perc: progress_label.config(text=f"Progress: {p}%"))
-                    except:
-                        pass
-        
-        process.wait()
-        
-        log_output(f"\nProcess finished with code: {process.returncode}")
-        
-        if process.returncode == 0:
-            root.after(0, lambda: progress_label.config(text="Progress: 100% - Complete!"))
-            root.after(0, lambda: messagebox.showinfo("Success", f"Download complete!\nSaved as:\n{out_path}"))
+        if returncode == 0:
+            if scratch_dir:
+                job.set_state(JOB_POSTPROCESSING)
+                source = fetched_file(scratch_dir)
+                # The transcode stage owns the scratch folder and log file from here on
+                handoff, scratch_dir, handed_off = scratch_dir, None, True
+                transcode_pool.submit(lambda: transcode_stage(job, key, source, handoff))
+                return
+            if fetch_path != out_path:
+                stem = os.path.splitext(out_path)[0]
+                for ext in MUXERS:
+                    if os.path.exists(f"{stem}.{ext}"):
+                        job.out_path, job.filename = f"{stem}.{ext}", os.path.basename(f"{stem}.{ext}")
+                        break
+            finish_job(job, key)
+        elif job.failure != FAILURE_PERMANENT and job.retries < settings["retry_limit"]:
+            delay = retry_delay(job.retries)
+            job.retries += 1
+            job.error = f"yt-dlp returned error code {returncode} ({job.failure})"
+            log_output(f"{job.failure.capitalize()} failure, retry {job.retries}/{settings['retry_limit']} "
+                       f"in {delay:.0f}s", job)
+            # The scratch folder stays, so the retry continues its partial download
+            scratch_dir = None
+            download_queue.retry(job, delay)
         else:
-            root.after(0, lambda: progress_label.config(text="Download failed"))
-            root.after(0, lambda: messagebox.showerror("Download failed", 
-                f"yt-dlp returned error code {process.returncode}\n\nCheck the console for details.\n\nTry updating yt-dlp with the Update button!"))
+            job.error = f"yt-dlp returned error code {returncode} ({job.failure})"
+            job.set_state(JOB_FAILED)
+            ui_after(lambda: messagebox.showerror("Download failed", 
+                f"{job.filename}\n\nyt-dlp returned error code {returncode}\n\nCheck the console for details.\n\nTry updating yt-dlp with the Update button!"))
     
     except Exception as e:
-        log_output(f"\nERROR: {e}")
-        root.after(0, lambda: progress_label.config(text="Download failed"))
-        root.after(0, lambda: messagebox.showerror("Download failed", str(e)))
+        log_output(f"\nERROR: {e}", job)
+        job.error = str(e)
+        job.set_state(JOB_FAILED)
+        message = str(e)
+        ui_after(lambda: messagebox.showerror("Download failed", message))
+    finally:
+        # The format URLs in it are spent or about to be; a retry extracts again
+        discard_info_json(info_json)
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if not handed_off:
+            close_job_log(job)
+
+# --- Playlist expansion ---
+PLAYLIST_RESOLVE_WORKERS = 8
+
+def expand_playlist(url):
+    """(url, title) for every entry of a playlist or channel, from one flat extraction"""
+    wait_for_ytdlp_upgrade()
+    import yt_dlp
+    ydl_opts = {
+        "quiet": True,
+        "no_warnings": True,
+        "extract_flat": "in_playlist",
+        "extractor_args": {"youtube": {"player_client": ["android", "web"]}}
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if info.get("_type") != "playlist":
+        return [(info.get("webpage_url") or url, info.get("title"))]
+    entries = []
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        entry_url = entry.get("url") or entry.get("webpage_url")
+        if entry.get("ie_key") == "Youtube" and entry.get("id"):
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if entry_url:
+            entries.append((entry_url, entry.get("title")))
+    return entries
+
+def resolve_entry_title(entry_url):
+    """Title for a flat entry that came without one; falls back to the video ID"""
+    try:
+        return get_video_info(entry_url).get("title")
+    except Exception as e:
+        log_output(f"Could not resolve {entry_url}: {e}")
+        return library_key(entry_url)[1]
+
+def enqueue_playlist(url, format_type):
+    """Queue one job per playlist entry that is not in the library yet; returns the jobs"""
+    entries = expand_playlist(url)
+    log_output(f"Playlist: {len(entries)} entries in {url}")
+
+    jobs = []
+    used_names = set()
+    def add_job(entry_url, title):
+        filename = clean_filename(title or library_key(entry_url)[1], "." + output_formats(format_type)[0])
+        stem, ext = os.path.splitext(filename)
+        counter = 2
+        while filename.lower() in used_names or os.path.exists(os.path.join(path_music_dir, filename)):
+            filename = f"{stem} ({counter}){ext}"
+            counter += 1
+        used_names.add(filename.lower())
+        jobs.append(download_queue.submit(DownloadJob(entry_url, filename, format_type)))
+
+    untitled = []
+    skipped = 0
+    for entry_url, title in entries:
+        if all(library_file(library_key(entry_url), fmt) for fmt in output_formats(format_type)):
+            skipped += 1
+        elif title:
+            add_job(entry_url, title)
+        else:
+            untitled.append(entry_url)
+
+    # Entries without a flat title need a full extraction each; run those side by side,
+    # queueing every entry as soon as its title is known
+    if untitled:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        with ThreadPoolExecutor(max_workers=PLAYLIST_RESOLVE_WORKERS) as pool:
+            futures = {pool.submit(resolve_entry_title, u): u for u in untitled}
+            for future in as_completed(futures):
+                add_job(futures[future], future.result())
+
+    log_output(f"Playlist: queued {len(jobs)}, {skipped} already in library")
+    return jobs
 
 # --- Wrapper functions ---
-def download_mp3():
+def enqueue_download(format_type):
+    """Validate the input fields and put a job on the download queue"""
     url = entry_url.get().strip()
     title = entry_name.get().strip()
-    if not url or not title:
+    playlist = playlist_var.get()
+    if not url or not (title or playlist):
         messagebox.showwarning("Input error", "Please enter URL and filename.")
         return
-    filename = clean_filename(title, ".mp3")
-    threading.Thread(target=download_file_thread, args=(url, filename, "mp3"), daemon=True).start()
+    if not dependencies_ready:
+        messagebox.showwarning("Not Ready", "Dependencies are still loading. Please wait...")
+        return
+    if setup_error:
+        messagebox.showerror("Setup Error", f"Dependencies failed to load:\n{setup_error}")
+        return
+    if playlist:
+        threading.Thread(target=expand_in_background, args=(url, format_type), daemon=True).start()
+        return
+    filename = clean_filename(title, "." + output_formats(format_type)[0])
+    job = download_queue.submit(DownloadJob(url, filename, format_type, PRIORITY_INTERACTIVE))
+    log_output(f"Queued #{job.id}: {filename}")
+
+def expand_in_background(url, format_type):
+    """Worker thread: expand a playlist URL into queued jobs"""
+    ui_after(lambda: resolve_label.config(text="Expanding playlist..."))
+    try:
+        jobs = enqueue_playlist(url, format_type)
+        ui_after(lambda: resolve_label.config(text=f"Queued {len(jobs)} from playlist"))
+    except Exception as e:
+        log_output(f"Playlist expansion failed: {e}")
+        ui_after(lambda: resolve_label.config(text=""))
+        message = f"Could not expand playlist:\n{e}"  # e is unbound once the except block ends
+        ui_after(lambda: messagebox.showerror("Playlist Error", message))
+
+def download_mp3():
+    enqueue_download("mp3")
 
 def download_mp4():
-    url = entry_url.get().strip()
-    title = entry_name.get().strip()
-    if not url or not title:
-        messagebox.showwarning("Input error", "Please enter URL and filename.")
+    enqueue_download("mp4")
+
+def download_both():
+    enqueue_download("both")
+
+def set_parallel_downloads():
+    """Apply the parallel-downloads spinbox to the queue and remember it"""
+    try:
+        count = max(1, int(spin_workers.get()))
+    except ValueError:
         return
-    filename = clean_filename(title, ".mp4")
-    threading.Thread(target=download_file_thread, args=(url, filename, "mp4"), daemon=True).start()
+    download_queue.set_max_workers(count)
+    settings["max_workers"] = count
+    save_settings()
+
+# Queue panel and progress label repaint rate, independent of how fast progress events arrive
+QUEUE_REFRESH_MS = 500
+
+def set_tuning_profile(name):
+    """Apply the download profile picked in the queue panel and remember it"""
+    settings["tuning_profile"] = name
+    save_settings()
+    log_output(f"Download profile: {name} {tuning_args(download_tuning(name))}")
+
+def progress_text():
+    """Progress label text from the aggregate over all running jobs"""
+    totals = download_queue.aggregate_progress()
+    if totals["active"]:
+        percent = totals["downloaded"] * 100 / totals["total"] if totals["total"] else 0
+        return (f"Progress: {percent:.0f}% · {totals['active']} active · "
+                f"{format_bytes(totals['rate'])}/s (avg {format_bytes(totals['smoothed_rate'])}/s) · "
+                f"ETA {format_eta(totals['eta'])}")
+    counts = download_queue.counts()
+    if counts.get(JOB_FAILED) and not counts.get(JOB_DONE):
+        return "Download failed"
+    if counts.get(JOB_DONE):
+        return "Progress: 100% - Complete!"
+    return "Progress: 0%"
+
+queue_rows = []  # [job, line shown, state it was drawn in] per queue panel row, in listbox order
+
+def refresh_queue_panel():
+    """Update the queue list and progress from the job states (polled from the Tk thread)"""
+    jobs = list(download_queue.jobs)
+    listed = set(jobs)
+    # Finished jobs past FINISHED_JOBS_KEPT have left the queue: drop their rows
+    for index in range(len(queue_rows) - 1, -1, -1):
+        if queue_rows[index][0] not in listed:
+            queue_listbox.delete(index)
+            del queue_rows[index]
+    # Jobs are only ever appended, so the rows left are the first jobs; add the new ones
+    for job in jobs[len(queue_rows):]:
+        queue_rows.append([job, None, None])
+        queue_listbox.insert(tk.END, "")
+    # Rewrite only the rows whose text changed; a finished job's row never changes again
+    for index, row in enumerate(queue_rows):
+        job, shown, drawn = row
+        if drawn in JOB_FINISHED_STATES:
+            continue
+        state = job.state
+        line = job.describe()
+        if line != shown:
+            selected = queue_listbox.selection_includes(index)
+            queue_listbox.delete(index)
+            queue_listbox.insert(index, line)
+            if selected:
+                queue_listbox.selection_set(index)
+            row[1] = line
+        row[2] = state
+    progress_label.config(text=progress_text())
+    if root.focus_get() is not spin_workers and spin_workers.get() != str(download_queue.max_workers):
+        # The concurrency controller moved it
+        spin_workers.delete(0, tk.END)
+        spin_workers.insert(0, str(download_queue.max_workers))
+    counts = download_queue.counts()
+    queue_summary_label.config(text="Queue: " + ", ".join(
+        f"{counts.get(state, 0)} {state}"
+        for state in (JOB_QUEUED, JOB_RUNNING, JOB_POSTPROCESSING, JOB_PAUSED, JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+        if state not in (JOB_PAUSED, JOB_CANCELLED) or counts.get(state)))
+    root.after(QUEUE_REFRESH_MS, refresh_queue_panel)
+
+def selected_jobs():
+    """Jobs highlighted in the queue panel"""
+    return [queue_rows[index][0] for index in queue_listbox.curselection() if index < len(queue_rows)]
+
+def pause_selected():
+    for job in selected_jobs():
+        download_queue.pause(job)
+
+def resume_selected():
+    for job in selected_jobs():
+        download_queue.resume(job)
+
+def cancel_selected():
+    jobs = [job for job in selected_jobs() if job.state not in JOB_FINISHED_STATES]
+    if jobs and messagebox.askyesno("Cancel downloads", f"Cancel {len(jobs)} download(s) and delete their partial files?"):
+        for job in jobs:
+            download_queue.cancel(job)
 
 def toggle_console():
     """Toggle console visibility"""
     if console_frame.winfo_viewable():
         console_frame.grid_remove()
         btn_toggle_console.config(text="Show Console ▼")
-        root.geometry("600x220")
+        root.geometry(WINDOW_SIZE)
     else:
         console_frame.grid()
+        rebuild_console()
         btn_toggle_console.config(text="Hide Console ▲")
-        root.geometry("600x520")
+        root.geometry(WINDOW_SIZE_CONSOLE)
 
 # --- GUI ---
-root = tk.Tk()
-root.title("Universal Audio/Video Downloader")
-root.geometry("600x220")
+WINDOW_SIZE = "720x420"
+WINDOW_SIZE_CONSOLE = "720x720"
+
+def build_gui():
+    """Create the main window and its widgets"""
+    global root, entry_url, entry_name, progress_label, status_label, btn_toggle_console
+    global console_frame, console_text, spin_workers, queue_listbox, queue_summary_label, resolve_label
+    global playlist_var
+
+    root = tk.Tk()
+    root.title("Universal Audio/Video Downloader")
+    root.geometry(WINDOW_SIZE)
+
+    # Main frame
+    main_frame = tk.Frame(root)
+    main_frame.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+
+    tk.Label(main_frame, text="Video/Audio URL:").grid(row=0, column=0, padx=10, pady=10, sticky="w")
+    entry_url = tk.Entry(main_frame, width=50)
+    entry_url.grid(row=0, column=1, padx=10, pady=10)
+    entry_url.bind("<FocusOut>", update_title)
+
+    tk.Label(main_frame, text="Save as:").grid(row=1, column=0, padx=10, pady=5, sticky="w")
+    entry_name = tk.Entry(main_frame, width=50)
+    entry_name.grid(row=1, column=1, padx=10, pady=5)
+
+    # Download buttons frame
+    download_frame = tk.Frame(main_frame)
+    download_frame.grid(row=2, column=1, pady=10, sticky="w")
+
+    btn_download_mp3 = tk.Button(download_frame, text="Download MP3", command=download_mp3, width=15, bg="#2196F3", fg="white")
+    btn_download_mp3.pack(side="left", padx=5)
+
+    btn_download_mp4 = tk.Button(download_frame, text="Download MP4", command=download_mp4, width=15, bg="#2196F3", fg="white")
+    btn_download_mp4.pack(side="left", padx=5)
+
+    btn_download_both = tk.Button(download_frame, text="Download Both", command=download_both, width=15, bg="#2196F3", fg="white")
+    btn_download_both.pack(side="left", padx=5)
+
+    playlist_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(download_frame, text="Playlist", variable=playlist_var).pack(side="left", padx=5)
+
+    resolve_label = tk.Label(download_frame, text="", fg="gray")
+    resolve_label.pack(side="left", padx=5)
 
-# Main frame
-main_frame = tk.Frame(root)
-main_frame.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+    progress_label = tk.Label(main_frame, text="Progress: 0%")
+    progress_label.grid(row=3, column=0, columnspan=2, pady=5)
 
-tk.Label(main_frame, text="Video/Audio URL:").grid(row=0, column=0, padx=10, pady=10, sticky="w")
-entry_url = tk.Entry(main_frame, width=50)
-entry_url.grid(row=0, column=1, padx=10, pady=10)
-entry_url.bind("<FocusOut>", update_title)
+    status_label = tk.Label(main_frame, text="Loading dependencies...", fg="orange")
+    status_label.grid(row=4, column=0, columnspan=2, pady=5)
 
-tk.Label(main_frame, text="Save as:").grid(row=1, column=0, padx=10, pady=5, sticky="w")
-entry_name = tk.Entry(main_frame, width=50)
-entry_name.grid(row=1, column=1, padx=10, pady=5)
+    # Button frame for console and update
+    button_frame = tk.Frame(main_frame)
+    button_frame.grid(row=5, column=0, columnspan=2, pady=5)
 
-# Download buttons frame
-download_frame = tk.Frame(main_frame)
-download_frame.grid(row=2, column=1, pady=10, sticky="w")
+    btn_toggle_console = tk.Button(button_frame, text="Show Console ▼", command=toggle_console, width=20)
+    btn_toggle_console.pack(side="left", padx=5)
 
-btn_download_mp3 = tk.Button(download_frame, text="Download MP3", command=download_mp3, width=15, bg="#2196F3", fg="white")
-btn_download_mp3.pack(side="left", padx=5)
+    btn_update_ytdlp = tk.Button(button_frame, text="Update yt-dlp", command=update_ytdlp, width=20, bg="#4CAF50", fg="white")
+    btn_update_ytdlp.pack(side="left", padx=5)
 
-btn_download_mp4 = tk.Button(download_frame, text="Download MP4", command=download_mp4, width=15, bg="#2196F3", fg="white")
-btn_download_mp4.pack(side="left", padx=5)
+    # Queue panel
+    queue_frame = tk.Frame(main_frame)
+    queue_frame.grid(row=6, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
 
-progress_label = tk.Label(main_frame, text="Progress: 0%")
-progress_label.grid(row=3, column=0, columnspan=2, pady=5)
+    queue_header = tk.Frame(queue_frame)
+    queue_header.pack(fill="x")
+    queue_summary_label = tk.Label(queue_header, text="Queue: empty", anchor="w")
+    queue_summary_label.pack(side="left")
+    spin_workers = tk.Spinbox(queue_header, from_=1, to=16, width=3, command=set_parallel_downloads)
+    spin_workers.delete(0, tk.END)
+    spin_workers.insert(0, str(download_queue.max_workers))
+    spin_workers.bind("<Return>", lambda e: set_parallel_downloads())
+    spin_workers.pack(side="right")
+    tk.Label(queue_header, text="Parallel downloads:").pack(side="right")
+    profile_var = tk.StringVar(value=settings["tuning_profile"])
+    tk.OptionMenu(queue_header, profile_var, *sorted(tuning_profiles()), command=set_tuning_profile).pack(side="right", padx=5)
+    tk.Label(queue_header, text="Profile:").pack(side="right")
 
-status_label = tk.Label(main_frame, text="Loading dependencies...", fg="orange")
-status_label.grid(row=4, column=0, columnspan=2, pady=5)
+    queue_listbox = tk.Listbox(queue_frame, height=6, selectmode=tk.EXTENDED)
+    queue_listbox.pack(fill="x")
 
-# Button frame for console and update
-button_frame = tk.Frame(main_frame)
-button_frame.grid(row=5, column=0, columnspan=2, pady=5)
+    job_buttons = tk.Frame(queue_frame)
+    job_buttons.pack(fill="x", pady=(3, 0))
+    tk.Button(job_buttons, text="Pause", command=pause_selected, width=10).pack(side="left")
+    tk.Button(job_buttons, text="Resume", command=resume_selected, width=10).pack(side="left", padx=5)
+    tk.Button(job_buttons, text="Cancel", command=cancel_selected, width=10).pack(side="left")
 
-btn_toggle_console = tk.Button(button_frame, text="Show Console ▼", command=toggle_console, width=20)
-btn_toggle_console.pack(side="left", padx=5)
+    # Console frame (hidden by default)
+    console_frame = tk.Frame(root)
+    console_frame.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
+    console_frame.grid_remove()  # Hide by default
 
-btn_update_ytdlp = tk.Button(button_frame, text="Update yt-dlp", command=update_ytdlp, width=20, bg="#4CAF50", fg="white")
-btn_update_ytdlp.pack(side="left", padx=5)
+    tk.Label(console_frame, text="Console Output:", anchor="w").pack(fill="x")
+    console_text = scrolledtext.ScrolledText(console_frame, height=15, width=70, bg="black", fg="lime")
+    console_text.pack(fill="both", expand=True)
 
-# Console frame (hidden by default)
-console_frame = tk.Frame(root)
-console_frame.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
-console_frame.grid_remove()  # Hide by default
+    # Configure grid weights
+    root.grid_rowconfigure(1, weight=1)
+    root.grid_columnconfigure(0, weight=1)
+
+# --- Batch mode ---
+def read_batch_file(path, default_format="mp3"):
+    """Parse 'URL [mp3|mp4|both] [filename]' lines; '-' reads stdin, '#' starts a comment"""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    jobs = []
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 2)
+            url = parts[0]
+            format_type = default_format
+            filename = None
+            if len(parts) > 1 and parts[1].lower() in ("mp3", "mp4", "both"):
+                format_type = parts[1].lower()
+                parts = parts[:1] + parts[2:]
+            if len(parts) > 1:
+                filename = clean_filename(" ".join(parts[1:]), "." + output_formats(format_type)[0])
+            jobs.append(DownloadJob(url, filename, format_type))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return jobs
+
+def run_batch(args):
+    """Download a URL list without a window and print a JSON summary"""
+    jobs = read_batch_file(args.batch, args.format) if args.batch else []
+    workers = args.jobs or settings["max_workers"]
+    log_output(f"Batch: {len(jobs)} {'playlist(s)' if args.playlist else 'job(s)'}, {workers} in parallel"
+               + (" (adaptive)" if concurrency.thread else ""))
+
+    setup_dependencies()
+    if setup_error or not dependencies_ready:
+        log_output(f"Dependencies failed to load: {setup_error}")
+        return 2
+
+    started = time.time()
+    download_queue.set_max_workers(workers)
+    if args.playlist:
+        # Each line is a playlist or channel; its entries start downloading while later lines expand
+        listed, jobs = jobs, []
+        for job in listed:
+            try:
+                jobs.extend(enqueue_playlist(job.url, job.format_type))
+            except Exception as e:
+                log_output(f"Playlist expansion failed for {job.url}: {e}")
+                job.error = str(e)
+                job.set_state(JOB_FAILED)
+                jobs.append(job)
+    else:
+        for job in jobs:
+            download_queue.submit(job)
+    if args.resume:
+        jobs.extend(recover_jobs())
+    download_queue.wait()
+
+    results = [job.summary() for job in jobs]
+    summary = {
+        "total": len(results),
+        "done": sum(1 for r in results if r["status"] == JOB_DONE),
+        "failed": sum(1 for r in results if r["status"] == JOB_FAILED),
+        "cancelled": sum(1 for r in results if r["status"] == JOB_CANCELLED),
+        "bytes": sum(r["bytes"] for r in results),
+        "wall_time": round(time.time() - started, 3),
+        "jobs": results,
+    }
+    if args.summary == "-":
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary["failed"] == 0 else 1
+
+startup_timings["import"] = time.perf_counter() - STARTUP_STARTED
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Universal Audio/Video Downloader")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="download the URLs listed in FILE ('-' for stdin) without opening a window")
+    parser.add_argument("-f", "--format", choices=("mp3", "mp4", "both"), default="mp3",
+                        help="format for lines that don't name one (default: mp3)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="fixed number of parallel downloads (default: start at max_workers from "
+                             "settings.json and adapt, see adaptive_concurrency)")
+    parser.add_argument("--summary", metavar="FILE", default="-",
+                        help="write the JSON summary to FILE instead of stdout")
+    parser.add_argument("--playlist", action="store_true",
+                        help="treat each URL as a playlist or channel and download every entry")
+    parser.add_argument("--resume", action="store_true",
+                        help="without a window, finish the jobs an earlier session left unfinished")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="re-index the music directory for duplicate detection and exit")
+    args = parser.parse_args(argv)
+
+    if args.rebuild_index:
+        started = time.time()
+        result = library_index.rebuild(path_music_dir)
+        result["wall_time"] = round(time.time() - started, 3)
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+    if settings["metrics_port"] is not None:
+        try:
+            start_metrics_server(int(settings["metrics_port"]))
+        except (OSError, ValueError) as e:
+            log_output(f"Could not start the metrics endpoint: {e}")
+    if settings["adaptive_concurrency"] and not args.jobs:
+        concurrency.start()
+    if args.batch or args.resume:
+        return run_batch(args)
 
-tk.Label(console_frame, text="Console Output:", anchor="w").pack(fill="x")
-console_text = scrolledtext.ScrolledText(console_frame, height=15, width=70, bg="black", fg="lime")
-console_text.pack(fill="both", expand=True)
+    build_gui()
 
-# Configure grid weights
-root.grid_rowconfigure(1, weight=1)
-root.grid_columnconfigure(0, weight=1)
+    # Start dependency setup in background thread
+    log_output("Initializing...")
+    threading.Thread(target=setup_then_resume, daemon=True).start()
+    refresh_queue_panel()
+    drain_log()
 
-# Start dependency setup in background thread
-log_output("Initializing...")
-threading.Thread(target=setup_dependencies, daemon=True).start()
+    root.mainloop()
+    return 0
 
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,9 +44,14 @@ else:
         os.makedirs(bin_path, exist_ok=True)
         zip_url = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
         zip_file = os.path.join(bin_path, "ffmpeg.zip")
-        urllib.request.urlretrieve(zip_url, zip_file)
+        with urllib.request.urlopen(zip_url) as response, open(zip_file, "wb") as target:
+            shutil.copyfileobj(response, target, 1024 * 1024)
         with zipfile.ZipFile(zip_file, "r") as zip_ref:
-            zip_ref.extractall(bin_path)
+            # Only the executables from the nested bin/ folder, streamed in chunks
+            for member in zip_ref.namelist():
+                if member.endswith(".exe") and "/bin/" in member:
+                    with zip_ref.open(member) as source, open(os.path.join(bin_path, os.path.basename(member)), "wb") as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
         os.remove(zip_file)
         print("ffmpeg setup complete.")
 
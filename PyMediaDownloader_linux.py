@@ -1,6 +1,12 @@
 import os
+import json
+import time
 import subprocess
 import sys
+import signal
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox
 import yt_dlp
@@ -15,6 +21,36 @@ os.makedirs(path_music_dir, exist_ok=True)
 # --- Path to cookies file (exported from your browser (firefox tool)) ---
 cookies_file = os.path.join(script_dir, "cookies.txt")
 
+# --- yt-dlp prints its progress dict as JSON behind this marker ---
+PROGRESS_PREFIX = "PMD-PROGRESS "
+PROGRESS_TEMPLATE = ["--progress-template", "download:" + PROGRESS_PREFIX + "%(progress)j"]
+
+# --- Download tuning: fragments fetched at once, ranged chunk size, buffer, optional external downloader ---
+CONCURRENT_FRAGMENTS = 4
+HTTP_CHUNK_SIZE = "10M"
+BUFFER_SIZE = "64K"
+EXTERNAL_DOWNLOADER = None  # e.g. "aria2c"
+EXTERNAL_DOWNLOADER_ARGS = "-x 8 -s 8 -k 1M"
+
+# --- Downloads run on a worker pool; only the Tk thread touches widgets ---
+MAX_PARALLEL_DOWNLOADS = 3
+UI_POLL_MS = 100
+download_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS)
+ui_events = queue.Queue()  # callbacks from worker threads, run by poll_ui() on the Tk thread
+jobs = []  # one dict per queued download: name, status, text, process
+jobs_lock = threading.Lock()
+
+def ui_call(callback):
+    """Run callback on the Tk thread"""
+    ui_events.put(callback)
+
+def tuning_args():
+    args = ["-N", str(CONCURRENT_FRAGMENTS), "--http-chunk-size", HTTP_CHUNK_SIZE, "--buffer-size", BUFFER_SIZE]
+    if EXTERNAL_DOWNLOADER:
+        args += ["--downloader", EXTERNAL_DOWNLOADER,
+                 "--downloader-args", f"{EXTERNAL_DOWNLOADER}:{EXTERNAL_DOWNLOADER_ARGS}"]
+    return args
+
 # --- Function to clean filenames ---
 def clean_filename(name, ext):
     invalid_chars = r'\/:*?"<>|'
@@ -24,8 +60,8 @@ def clean_filename(name, ext):
         name += ext
     return name
 
-# --- Generic download function using cookies if available ---
-def download_file(url, filename, format_type="mp3"):
+# --- Generic download function using cookies if available (runs on a pool thread) ---
+def download_file(url, filename, format_type="mp3", job=None):
     # Full absolute path to save file
     out_path = os.path.join(path_music_dir, filename)
     # Ensure directory exists
@@ -35,7 +71,7 @@ def download_file(url, filename, format_type="mp3"):
 
     # Build command for mp3 or mp4
     if format_type == "mp3":
-        cmd = ["yt-dlp", "-x", "--audio-format", "mp3", "-o", out_path, "--newline", url]
+        cmd = ["yt-dlp", "-x", "--audio-format", "mp3", "-o", out_path, "--newline"] + PROGRESS_TEMPLATE + tuning_args() + [url]
     else:  # mp4
         cmd = [
             "yt-dlp",
@@ -43,63 +79,110 @@ def download_file(url, filename, format_type="mp3"):
             "-o", out_path,
             "--merge-output-format", "mp4",
             "--newline",
-            url
-        ]
+        ] + PROGRESS_TEMPLATE + tuning_args() + [url]
 
     # Add cookies if file exists
     if os.path.exists(cookies_file):
         cmd += ["--cookies", cookies_file]
 
     print("Downloading to:", out_path)  # Debug: show full path
+    if job is None:
+        job = {"name": filename, "status": "running", "text": "", "process": None}
 
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        # Own session, so closing the window can stop yt-dlp together with its ffmpeg
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   start_new_session=True)
+        job["process"] = process
+        last_update = 0.0
         for line in process.stdout:
             line = line.strip()
-            if "%" in line:
-                try:
-                    perc = line.split("%")[0].split()[-1]
-                    progress_label.config(text=f"Progress: {perc}%")
-                    root.update_idletasks()
-                except:
-                    pass
+            if not line.startswith(PROGRESS_PREFIX):
+                continue
+            try:
+                progress = json.loads(line[len(PROGRESS_PREFIX):])
+            except ValueError:
+                continue
+            # Refresh the job's text at most 10 times per second
+            now = time.monotonic()
+            total = progress.get("total_bytes") or progress.get("total_bytes_estimate")
+            if not total or now - last_update < 0.1:
+                continue
+            last_update = now
+            text = f"{progress.get('downloaded_bytes', 0) * 100 / total:.1f}%"
+            if progress.get("speed"):
+                text += f"  {progress['speed'] / 1048576:.1f} MiB/s"
+            if progress.get("eta") is not None:
+                text += f"  ETA {int(progress['eta']) // 60}:{int(progress['eta']) % 60:02d}"
+            job["text"] = text
         process.wait()
-        if process.returncode == 0:
-            success = True
-            progress_label.config(text="Progress: 100% - Complete!")
-        else:
-            progress_label.config(text="Download failed. Check URL or cookies if needed.")
-    except subprocess.CalledProcessError:
-        pass
+        success = process.returncode == 0
+    except OSError as e:
+        print("Could not start yt-dlp:", e)
 
     return success, out_path
 
-# --- Wrapper functions ---
-def download_mp3():
-    url = entry_url.get().strip()
-    title = entry_name.get().strip()
-    if not url or not title:
-        messagebox.showwarning("Input error", "Please enter URL and filename.")
-        return
-    filename = clean_filename(title, ".mp3")
-    success, out_path = download_file(url, filename, "mp3")
+def run_job(job, url, filename, format_type):
+    """Pool thread: download one queued job and report the result on the Tk thread"""
+    job["status"] = "running"
+    success, out_path = download_file(url, filename, format_type, job)
+    job["status"] = "done" if success else "failed"
+    job["text"] = ""
     if success:
-        messagebox.showinfo("Success", f"Download complete!\nSaved as {out_path}")
+        ui_call(lambda: messagebox.showinfo("Success", f"Download complete!\nSaved as {out_path}"))
     else:
-        messagebox.showerror("Download failed", "Download failed. Check URL or cookies if needed.")
+        ui_call(lambda: messagebox.showerror("Download failed", f"{filename}\n\nDownload failed. Check URL or cookies if needed."))
 
-def download_mp4():
+# --- Wrapper functions ---
+def enqueue(format_type):
+    """Queue a download from the input fields; returns at once"""
     url = entry_url.get().strip()
     title = entry_name.get().strip()
     if not url or not title:
         messagebox.showwarning("Input error", "Please enter URL and filename.")
         return
-    filename = clean_filename(title, ".mp4")
-    success, out_path = download_file(url, filename, "mp4")
-    if success:
-        messagebox.showinfo("Success", f"Download complete!\nSaved as {out_path}")
-    else:
-        messagebox.showerror("Download failed", "Download failed. Check URL or cookies if needed.")
+    filename = clean_filename(title, "." + format_type)
+    job = {"name": filename, "status": "queued", "text": "", "process": None}
+    with jobs_lock:
+        jobs.append(job)
+    download_pool.submit(run_job, job, url, filename, format_type)
+
+def download_mp3():
+    enqueue("mp3")
+
+def download_mp4():
+    enqueue("mp4")
+
+def poll_ui():
+    """Tk thread: run the workers' callbacks and redraw the job list"""
+    while True:
+        try:
+            callback = ui_events.get_nowait()
+        except queue.Empty:
+            break
+        callback()
+    with jobs_lock:
+        lines = [f"[{job['status']}{' ' + job['text'] if job['text'] else ''}] {job['name']}" for job in jobs]
+    if lines != list(job_list.get(0, tk.END)):
+        job_list.delete(0, tk.END)
+        for line in lines:
+            job_list.insert(tk.END, line)
+    running = sum(1 for job in jobs if job["status"] == "running")
+    waiting = sum(1 for job in jobs if job["status"] == "queued")
+    progress_label.config(text=f"{running} downloading, {waiting} waiting" if running or waiting else "Idle")
+    root.after(UI_POLL_MS, poll_ui)
+
+def on_close():
+    """Stop running downloads and queued ones, then close the window"""
+    download_pool.shutdown(wait=False, cancel_futures=True)
+    with jobs_lock:
+        for job in jobs:
+            if job["process"] is not None and job["process"].poll() is None:
+                try:
+                    os.killpg(job["process"].pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+    root.destroy()
 
 # --- GUI ---
 root = tk.Tk()
@@ -118,7 +201,12 @@ btn_download_mp4 = tk.Button(root, text="Download MP4", command=download_mp4)
 btn_download_mp3.grid(row=2, column=0, columnspan=2, pady=10)
 btn_download_mp4.grid(row=3, column=0, columnspan=2, pady=10)
 
-progress_label = tk.Label(root, text="Progress: 0%")
+progress_label = tk.Label(root, text="Idle")
 progress_label.grid(row=4, column=0, columnspan=2, pady=5)
 
+job_list = tk.Listbox(root, height=6)
+job_list.grid(row=5, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
+
+root.protocol("WM_DELETE_WINDOW", on_close)
+poll_ui()
 root.mainloop()
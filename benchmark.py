@@ -0,0 +1,527 @@
+"""Offline benchmarks for PyMediaDownloader
+
+Everything runs against a local stand-in HTTP server, no real sites are contacted.
+
+    python benchmark.py engines --jobs 20 --size 256
+    python benchmark.py startup --jobs 10
+    python benchmark.py ffmpeg-bootstrap --size 65536
+    python benchmark.py fragments --jobs 3 --size 16384 --latency 20
+    python benchmark.py queue --items 40 --workers 4 --engine stub
+    python benchmark.py audio-policy --jobs 4 --duration 300 --ffmpeg /path/to/ffmpeg/bin
+"""
+import io
+import os
+import sys
+import json
+import time
+import zipfile
+import hashlib
+import shutil
+import argparse
+import tempfile
+import subprocess
+import threading
+import statistics
+import tracemalloc
+import http.client
+import http.server
+
+import PyMediaDownloader as app
+
+# --- Local stand-in media server ---
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's in-memory files, with Range support like a real CDN"""
+
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def do_GET(self):
+        self.send_file(head=False)
+
+    def send_file(self, head):
+        path = self.path.split("?")[0]
+        entry = self.server.files.get(path)
+        if entry is None:
+            self.send_error(404)
+            return
+        data, content_type = entry
+        if self.server.latency:
+            time.sleep(self.server.latency)  # round trip to a far-away CDN edge
+        cut = self.server.cut_after.pop(path, None)
+        start, end = 0, len(data) - 1
+        etag = '"%s"' % hashlib.sha1(data[:65536]).hexdigest()[:16]
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range != etag:
+            range_header = None  # the client's part is from another version: send the whole file
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start = int(first) if first else 0
+            end = min(int(last), end) if last else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if head:
+            return
+        body = memoryview(data)[start:end + 1]  # no copy, keeps memory measurements honest
+        if cut is not None:
+            # Simulate a dropped connection: announce the full length, send only part
+            body = body[:cut]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MediaServer(http.server.ThreadingHTTPServer):
+    """Local HTTP server on a free port; add files with add()"""
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (ranged chunks, cancelled fragments) is normal here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MediaHandler)
+        self.daemon_threads = True
+        self.files = {}
+        self.cut_after = {}  # path -> bytes sent before the next response to it breaks off
+        self.bytes_sent = 0
+        self.latency = 0.0  # seconds before each response
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def add(self, path, data, content_type="application/octet-stream"):
+        self.files[path] = (data, content_type)
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+def synthetic_media(size):
+    """Incompressible filler bytes that only look like an MP4 by name"""
+    return os.urandom(size)
+
+# --- Stand-in yt-dlp executable ---
+# Understands the command lines build_ytdlp_cmd() writes, fetches the benchmark server's
+# progressive files and HLS playlists, and prints --progress-template lines. It measures
+# this app's own overhead without yt-dlp's extraction and postprocessing in the way.
+STUB_YTDLP = r'''
+import os, sys, json, time, urllib.error, urllib.request
+
+VALUE_FLAGS = {"-f", "-o", "-N", "--ffmpeg-location", "--progress-template", "--extractor-args",
+               "--http-chunk-size", "--buffer-size", "--downloader", "--downloader-args",
+               "--audio-format", "--audio-quality", "--load-info-json", "--limit-rate", "--cookies"}
+
+def main(argv):
+    opts, url = {}, None
+    i = 0
+    while i < len(argv):
+        if argv[i] in VALUE_FLAGS:
+            opts[argv[i]] = argv[i + 1]
+            i += 2
+            continue
+        if not argv[i].startswith("-"):
+            url = argv[i]
+        i += 1
+    if "--load-info-json" in opts:
+        with open(opts["--load-info-json"], encoding="utf-8") as f:
+            url = json.load(f)["url"]
+    prefix = opts.get("--progress-template", "download:").split(":", 1)[1].replace("%(progress)j", "")
+    if url.endswith(".m3u8"):
+        base = url.rsplit("/", 1)[0]
+        with urllib.request.urlopen(url) as r:
+            parts = [base + "/" + line for line in r.read().decode().splitlines() if line and not line.startswith("#")]
+        ext = "mp4"
+    else:
+        parts, ext = [url], url.rsplit(".", 1)[-1]
+    out = opts["-o"].replace("%(ext)s", ext)
+    started, done, total = time.monotonic(), 0, None
+    def emit(status):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        speed = done / elapsed
+        print(prefix + json.dumps({"status": status, "filename": out, "downloaded_bytes": done,
+                                   "total_bytes_estimate": total, "speed": speed, "elapsed": elapsed,
+                                   "eta": (total - done) / speed if total and speed else None}), flush=True)
+    with open(out + ".part", "wb") as f:
+        for part in parts:
+            with urllib.request.urlopen(part) as r:
+                if total is None:
+                    total = int(r.headers.get("Content-Length") or 0) * len(parts)
+                while True:
+                    chunk = r.read(65536)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    done += len(chunk)
+                    emit("downloading")
+    os.replace(out + ".part", out)
+    emit("finished")
+    return 0
+
+try:
+    sys.exit(main(sys.argv[1:]))
+except urllib.error.URLError as e:
+    print(f"ERROR: {e}")
+    sys.exit(1)
+'''
+
+def install_stub_ytdlp(folder):
+    """Write the stand-in yt-dlp into folder and return the command to run it"""
+    script = os.path.join(folder, "yt-dlp-stub.py")
+    with open(script, "w", encoding="utf-8") as f:
+        f.write(f"#!{sys.executable}\n" + STUB_YTDLP)
+    if sys.platform == "win32":
+        launcher = os.path.join(folder, "yt-dlp-stub.cmd")
+        with open(launcher, "w", encoding="utf-8") as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+        return launcher
+    os.chmod(script, 0o755)
+    return script
+
+def peak_rss_kib():
+    """(this process, largest child) peak resident set size in KiB, or None where unknown"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    scale = 1024 if sys.platform == "darwin" else 1  # bytes on macOS, KiB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+# --- Scenario: per-job overhead of the two engines ---
+def bench_engines(args):
+    server = MediaServer()
+    url = server.add("/clip.mp4", synthetic_media(args.size * 1024), "video/mp4")
+    results = {}
+    for engine in ("subprocess", "inprocess"):
+        app.settings["engine"] = engine
+        if app.active_engine() != engine:
+            print(f"{engine:>10}: not available")
+            continue
+        timings = []
+        for i in range(args.jobs):
+            job = app.DownloadJob(url, f"bench-{engine}-{i}.mp4", "mp4")
+            started = time.perf_counter()
+            returncode = app.run_download(job, url, job.out_path, "mp4")
+            timings.append(time.perf_counter() - started)
+            if returncode != 0:
+                print(f"{engine:>10}: job {i} failed with code {returncode}")
+                break
+        results[engine] = timings
+        # The first in-process job pays for imports and extractor setup, report it separately
+        steady = timings[1:] or timings
+        print(f"{engine:>10}: first {timings[0] * 1000:7.1f} ms, "
+              f"median {statistics.median(steady) * 1000:7.1f} ms, "
+              f"mean {statistics.mean(steady) * 1000:7.1f} ms over {len(timings)} jobs")
+    if len(results) == 2:
+        saved = statistics.median(results["subprocess"][1:] or results["subprocess"]) - \
+                statistics.median(results["inprocess"][1:] or results["inprocess"])
+        print(f"in-process saves {saved * 1000:.1f} ms per job")
+    server.shutdown()
+
+# --- Scenario: startup time ---
+def measure_startup(work_dir, runs):
+    """Import, time-to-ready and process timings from fresh interpreters; None if one failed"""
+    # A fresh update-check record, so no pip run is part of the measurement
+    with open(os.path.join(work_dir, "dependency_state.json"), "w", encoding="utf-8") as f:
+        json.dump({"ytdlp_checked": time.time()}, f)
+    code = ("import json, PyMediaDownloader as m; m.setup_dependencies(); "
+            "print(json.dumps(m.startup_timings))")
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(app.__file__)))
+    samples = {}
+    for i in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=work_dir, env=env,
+                                capture_output=True, text=True)
+        samples.setdefault("process", []).append(time.perf_counter() - started)
+        if result.returncode != 0:
+            print(result.stderr)
+            return None
+        for key, value in json.loads(result.stdout.splitlines()[-1]).items():
+            samples.setdefault(key, []).append(value)
+    return samples
+
+def bench_startup(args):
+    """Module import and time-to-ready in fresh interpreters"""
+    samples = measure_startup(app.path_music_dir, args.jobs)
+    if samples is None:
+        return
+    for key in ("import", "ready", "process"):
+        if key in samples:
+            print(f"{key:>8}: median {statistics.median(samples[key]) * 1000:7.1f} ms "
+                  f"(min {min(samples[key]) * 1000:.1f}, max {max(samples[key]) * 1000:.1f})")
+        else:
+            print(f"{key:>8}: not reached (see setup errors with -v)")
+
+# --- Scenario: ffmpeg bootstrap ---
+def synthetic_ffmpeg_zip(size):
+    """A release-style zip: bin/ with three executables plus some docs"""
+    binaries = {name: os.urandom(size) for name in ("ffmpeg.exe", "ffprobe.exe", "ffplay.exe")}
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in binaries.items():
+            archive.writestr(f"ffmpeg-7.1-essentials_build/bin/{name}", data)
+        archive.writestr("ffmpeg-7.1-essentials_build/README.txt", "synthetic build\n" * 1000)
+    return buffer.getvalue(), binaries
+
+def bench_ffmpeg_bootstrap(args):
+    """Interrupted + resumed download, streamed extraction and manifest checks"""
+    server = MediaServer()
+    data, binaries = synthetic_ffmpeg_zip(args.size * 1024)
+    url = server.add("/ffmpeg.zip", data, "application/zip")
+    server.cut_after["/ffmpeg.zip"] = len(data) // 2
+    target = os.path.join(app.path_music_dir, "ffmpeg", "bin")
+
+    try:
+        app.bootstrap_ffmpeg(url, target)
+        raise AssertionError("the first download should have been cut off")
+    except (OSError, http.client.HTTPException):
+        part_size = os.path.getsize(os.path.join(target, "ffmpeg.zip.part"))
+    print(f"interrupted: kept {part_size} of {len(data)} bytes in ffmpeg.zip.part")
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    manifest = app.bootstrap_ffmpeg(url, target)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    refetched = server.bytes_sent - part_size
+    print(f"resumed: fetched {refetched} more bytes, unpacked in {elapsed * 1000:.1f} ms, "
+          f"peak Python memory {peak / 1024:.0f} KiB for {len(binaries['ffmpeg.exe']) / 1024:.0f} KiB binaries")
+    assert refetched == len(data) - part_size, "resume downloaded bytes twice"
+    assert sorted(os.listdir(target)) == ["ffmpeg.exe", "ffmpeg_manifest.json", "ffprobe.exe"]
+    for name in app.FFMPEG_BINARIES:
+        assert manifest[name]["sha256"] == hashlib.sha256(binaries[name]).hexdigest(), name
+
+    started = time.perf_counter()
+    assert app.verify_ffmpeg_manifest(target)
+    print(f"verify (stat only): {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    # Same size, different bytes: the mtime changes, so the file is re-hashed and rejected
+    path = os.path.join(target, "ffprobe.exe")
+    with open(path, "r+b") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(bytes([first[0] ^ 0xFF]))
+    os.utime(path, (time.time() + 5, time.time() + 5))
+    assert not app.verify_ffmpeg_manifest(target), "corrupted ffprobe.exe passed verification"
+    print("corrupted binary detected: OK")
+    server.shutdown()
+
+# --- Scenario: fragment concurrency on an HLS stream ---
+def hls_stream(server, size, segments):
+    """A finished HLS media playlist of equally sized segments"""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for i in range(segments):
+        server.add(f"/hls/seg{i}.ts", synthetic_media(max(1, size // segments)), "video/mp2t")
+        lines += ["#EXTINF:4.0,", f"seg{i}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    return server.add("/hls/stream.m3u8", ("\n".join(lines) + "\n").encode(), "application/vnd.apple.mpegurl")
+
+def bench_fragments(args):
+    """Throughput of each tuning profile against a high-latency HLS server"""
+    server = MediaServer()
+    server.latency = args.latency / 1000
+    url = hls_stream(server, args.size * 1024, args.segments)
+    baseline = None
+    for name in ("single", "balanced", "fast"):
+        app.settings["tuning_profile"] = name
+        rates = []
+        for i in range(args.jobs):
+            job = app.DownloadJob(url, f"bench-{name}-{i}.mp4", "mp4")
+            sent = server.bytes_sent
+            started = time.perf_counter()
+            returncode = app.run_download(job, url, job.out_path, "mp4")
+            elapsed = time.perf_counter() - started
+            if returncode != 0:
+                print(f"{name:>9}: job {i} failed with code {returncode}")
+                break
+            rates.append((server.bytes_sent - sent) / elapsed / 1048576)
+        if not rates:
+            continue
+        rate = statistics.median(rates)
+        baseline = baseline or rate
+        print(f"{name:>9}: {' '.join(app.tuning_args(app.download_tuning(name))):<52} "
+              f"median {rate:7.1f} MiB/s ({rate / baseline:.1f}x)")
+    print(f"engine {app.active_engine()}, {args.segments} segments, {args.latency} ms per request")
+    server.shutdown()
+
+# --- Scenario: CPU cost of each audio policy ---
+def synthetic_audio(ffmpeg, path, codec, duration):
+    """A tone encoded the way a site would serve it (AAC in .m4a, Opus in .webm)"""
+    encoders = {"aac": ["-c:a", "aac", "-b:a", "128k", "-f", "mp4"],
+                "opus": ["-c:a", "libopus", "-b:a", "128k", "-f", "webm"]}
+    subprocess.run([ffmpeg, "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}"]
+                   + encoders[codec] + [path], check=True)
+
+def bench_audio_policy(args):
+    """ffmpeg CPU time per item for every audio policy, on AAC and Opus sources"""
+    app.bin_path = args.ffmpeg or app.bin_path
+    work_dir = app.path_music_dir
+    sources = {}
+    for codec, ext in (("aac", "m4a"), ("opus", "webm")):
+        sources[codec] = os.path.join(work_dir, f"source-{codec}.{ext}")
+        synthetic_audio(app.ffmpeg_path(), sources[codec], codec, args.duration)
+    print(f"{'policy':>18} {'source':>6} {'output':>7} {'CPU/item':>10} {'wall/item':>10}")
+    for policy in ("mp3", "copy-if-compatible", "native"):
+        app.settings["audio_policy"] = policy
+        for codec, source in sources.items():
+            cpu, wall, output = 0.0, 0.0, None
+            for i in range(args.jobs):
+                job = app.DownloadJob("bench", f"bench-{policy}-{codec}-{i}.mp3", "mp3")
+                before, started = os.times(), time.perf_counter()
+                output = app.derive_outputs(job, source)[0]
+                after = os.times()
+                wall += time.perf_counter() - started
+                # ffmpeg runs as a child process; its CPU time shows up once it is reaped
+                cpu += (after.children_user - before.children_user) + (after.children_system - before.children_system)
+                os.remove(output)
+            print(f"{policy:>18} {codec:>6} {os.path.splitext(output)[1]:>7} "
+                  f"{cpu / args.jobs * 1000:8.0f} ms {wall / args.jobs * 1000:8.0f} ms")
+    print(f"{args.duration} s of audio per item; CPU time is not reported on Windows, compare wall time there")
+
+# --- Scenario: the whole download path under load ---
+class CallCounter:
+    """Wraps a module function and counts how often worker threads call it"""
+
+    def __init__(self, name, forward=None):
+        self.count = 0
+        self.forward = forward
+        self.original = getattr(app, name)
+        self.name = name
+        setattr(app, name, self)
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        if self.forward:
+            return self.forward(*args, **kwargs)
+
+    def restore(self):
+        setattr(app, self.name, self.original)
+
+def raw_fetch_time(urls):
+    """Seconds a bare urllib fetch of each URL (all segments for HLS) takes"""
+    import urllib.request
+    started = time.perf_counter()
+    for url in urls:
+        parts = [url]
+        if url.endswith(".m3u8"):
+            with urllib.request.urlopen(url) as r:
+                parts = [url.rsplit("/", 1)[0] + "/" + line for line in r.read().decode().splitlines()
+                         if line and not line.startswith("#")]
+        for part in parts:
+            with urllib.request.urlopen(part) as r:
+                while r.read(65536):
+                    pass
+    return time.perf_counter() - started
+
+def bench_queue(args):
+    """Items/s, MB/s, per-job overhead, peak RSS, UI pressure and startup for a mixed batch"""
+    server = MediaServer()
+    server.latency = args.latency / 1000
+    size = args.size * 1024
+    urls = []
+    for i in range(args.items):
+        if i % 2:
+            # Segmented: an HLS playlist of 8 segments under its own folder
+            lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:4"]
+            for n in range(8):
+                server.add(f"/hls{i}/seg{n}.ts", synthetic_media(max(1, size // 8)), "video/mp2t")
+                lines += ["#EXTINF:4.0,", f"seg{n}.ts"]
+            lines.append("#EXT-X-ENDLIST")
+            urls.append(server.add(f"/hls{i}/stream.m3u8", ("\n".join(lines) + "\n").encode(),
+                                   "application/vnd.apple.mpegurl"))
+        else:
+            urls.append(server.add(f"/progressive{i}.mp4", synthetic_media(size), "video/mp4"))
+
+    work_dir = app.path_music_dir
+    if args.engine == "stub":
+        app.settings["engine"] = "subprocess"
+        app.ytdlp_cmd = install_stub_ytdlp(work_dir)
+    else:
+        app.settings["engine"] = args.engine
+    app.library_index = app.LibraryIndex(os.path.join(work_dir, "library_index.sqlite3"))
+    app.job_store = app.JobStore(os.path.join(work_dir, "job_store.sqlite3"))
+    app.settings["job_log_files"] = False
+    app.settings["bandwidth_limit"] = None
+    app.settings["metrics_file"] = None
+    app.download_queue.set_max_workers(args.workers)
+
+    baseline = raw_fetch_time(urls[:2]) / min(2, len(urls))
+    sent_before = server.bytes_sent
+    ui_calls = CallCounter("ui_after")
+    log_calls = CallCounter("log_output", app.log_output)
+    started = time.perf_counter()
+    jobs = [app.download_queue.submit(app.DownloadJob(url, f"item-{i}.mp4", "mp4")) for i, url in enumerate(urls)]
+    app.download_queue.wait()
+    elapsed = time.perf_counter() - started
+    ui_calls.restore()
+    log_calls.restore()
+
+    done = [job for job in jobs if job.state == app.JOB_DONE]
+    moved = server.bytes_sent - sent_before
+    job_times = [job.finished - job.started for job in done]
+    print(f"engine {args.engine}, {args.items} items of {args.size} KiB, {args.workers} workers, "
+          f"{args.latency} ms latency")
+    print(f"   finished: {len(done)}/{len(jobs)} in {elapsed:.2f} s")
+    print(f" throughput: {len(done) / elapsed:.2f} items/s, {moved / elapsed / 1048576:.1f} MiB/s")
+    if job_times:
+        print(f"   per job: median {statistics.median(job_times) * 1000:.0f} ms, "
+              f"overhead over a bare fetch {(statistics.median(job_times) - baseline) * 1000:.0f} ms")
+        print("     stages: " + ", ".join(f"{stage} {statistics.median(job.stages[stage] for job in done) * 1000:.0f} ms"
+                                       for stage in app.JOB_STAGES))
+    own, child = peak_rss_kib()
+    if own is not None:
+        print(f"   peak RSS: {own / 1024:.1f} MiB (largest child process {child / 1024:.1f} MiB)")
+    print(f"   UI queue: {ui_calls.count} ui_after calls ({ui_calls.count / elapsed:.1f}/s), "
+          f"{log_calls.count} console lines ({log_calls.count / elapsed:.1f}/s)")
+    samples = measure_startup(work_dir, 3)
+    if samples and "ready" in samples:
+        print(f"    startup: import {statistics.median(samples['import']) * 1000:.0f} ms, "
+              f"ready {statistics.median(samples['ready']) * 1000:.0f} ms")
+    elif samples:
+        print(f"    startup: import {statistics.median(samples['import']) * 1000:.0f} ms, "
+              f"ready not reached (see setup errors with -v)")
+    server.shutdown()
+    return 0 if len(done) == len(jobs) else 1
+
+SCENARIOS = {
+    "audio-policy": bench_audio_policy,
+    "engines": bench_engines,
+    "ffmpeg-bootstrap": bench_ffmpeg_bootstrap,
+    "fragments": bench_fragments,
+    "queue": bench_queue,
+    "startup": bench_startup,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline PyMediaDownloader benchmarks")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--jobs", type=int, default=10, help="jobs per measurement (default: 10)")
+    parser.add_argument("--size", type=int, default=256, help="synthetic media size in KiB (default: 256)")
+    parser.add_argument("--segments", type=int, default=64, help="HLS segments for 'fragments' (default: 64)")
+    parser.add_argument("--latency", type=float, default=20, help="server delay per request in ms for 'fragments' (default: 20)")
+    parser.add_argument("--items", type=int, default=40, help="downloads in the 'queue' batch (default: 40)")
+    parser.add_argument("--workers", type=int, default=4, help="parallel downloads for 'queue' (default: 4)")
+    parser.add_argument("--engine", choices=("stub", "subprocess", "inprocess"), default="stub",
+                        help="'queue': the stand-in yt-dlp (default) or a real engine")
+    parser.add_argument("--duration", type=int, default=120, help="seconds of audio per item for 'audio-policy' (default: 120)")
+    parser.add_argument("--ffmpeg", metavar="DIR", help="folder with ffmpeg for 'audio-policy' (default: the app's)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the downloader's console output")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="pmd-bench-")
+    app.path_music_dir = work_dir
+    if not args.verbose:
+        app.log_output = lambda message, job=None: None
+    try:
+        return SCENARIOS[args.scenario](args) or 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())